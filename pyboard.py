@@ -65,17 +65,35 @@ Or:
 
     python pyboard.py test.py
 
+To avoid opening and soft-resetting the board on every invocation, keep
+a daemon holding the connection and point later invocations at it:
+
+    ./pyboard.py -d /dev/ttyACM0 --daemon --socket /tmp/pyboard.sock &
+    ./pyboard.py --socket /tmp/pyboard.sock test.py
+
+A session can be captured and played back later without the board, at
+full speed or (with replay-realtime:) with its original timing:
+
+    ./pyboard.py -d /dev/ttyACM0 --record session.rec test.py
+    ./pyboard.py -d replay:session.rec test.py
+
+A local directory can be mounted on the board while a script runs, so
+the script imports and reads its files without copying them over:
+
+    ./pyboard.py --mount src -c "import main"
+
 """
 
 import sys
 import time
 import os
 
-# try:
-#     stdout = sys.stdout.buffer
-# except AttributeError:
-#     # Python2 doesn't have buffer attr
-stdout = sys.stdout
+try:
+    stdout = sys.stdout.buffer
+except AttributeError:
+    # Python2 doesn't have buffer attr; the GUI also replaces stdout with
+    # a text widget via reset_stdout()
+    stdout = sys.stdout
 
 
 def reset_stdout(new_stdout):
@@ -93,6 +111,27 @@ class PyboardError(Exception):
     pass
 
 
+class PyboardChecksumError(PyboardError):
+    "A file's SHA-256 on the board differs from the one computed on the host."
+
+    def __init__(self, path, host_digest, board_digest):
+        super().__init__(
+            "checksum mismatch for %s: host %s, board %s" % (path, host_digest, board_digest)
+        )
+        self.path = path
+        self.host_digest = host_digest
+        self.board_digest = board_digest
+
+
+class PyboardEvalError(PyboardError):
+    "An expression given to Pyboard.eval_many() failed on the board."
+
+    def __init__(self, expression, message):
+        super().__init__("%s: %s" % (expression, message))
+        self.expression = expression
+        self.message = message
+
+
 class TelnetToSerial:
     def __init__(self, ip, user, password, read_timeout=None):
         self.tn = None
@@ -127,8 +166,8 @@ class TelnetToSerial:
             self.tn.close()
 
     def read(self, size=1):
+        timeout_count = 0
         while len(self.fifo) < size:
-            timeout_count = 0
             data = self.tn.read_eager()
             if len(data):
                 self.fifo.extend(data)
@@ -158,6 +197,132 @@ class TelnetToSerial:
             return n_waiting
 
 
+class SocketToSerial:
+    """Telnet-style network connection to a board over a plain TCP socket.
+
+    Unlike TelnetToSerial (telnetlib is gone from recent Pythons) reads wait
+    on select() instead of polling, incoming data collects in a bytearray
+    and read_timeout is a deadline for the whole read. Telnet option
+    negotiation is refused the way telnetlib does and otherwise stripped.
+    """
+
+    IAC, SB, SE, WILL, WONT, DO, DONT = 255, 250, 240, 251, 252, 253, 254
+
+    def __init__(self, ip, user, password, read_timeout=None, port=23):
+        import socket
+
+        self.sock = None
+        self.sock = socket.create_connection((ip, port), timeout=15)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.read_timeout = read_timeout
+        self.buf = bytearray()
+        self.pending_iac = b""
+        if self._read_past(b"Login as:"):
+            self.write(bytes(user, "ascii") + b"\r\n")
+            if self._read_past(b"Password:"):
+                # needed because of internal implementation details of the telnet server
+                time.sleep(0.2)
+                self.write(bytes(password, "ascii") + b"\r\n")
+                if self._read_past(b'Type "help()" for more information.'):
+                    # login successful
+                    return
+
+        raise PyboardError("Failed to establish a telnet connection with the board")
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def _deadline(self):
+        return None if self.read_timeout is None else time.time() + self.read_timeout
+
+    def _fill(self, timeout):
+        "Wait up to timeout seconds (None: forever) for data and buffer it."
+        import select
+
+        if not select.select([self.sock], [], [], timeout)[0]:
+            return
+        data = self.sock.recv(65536)
+        if not data:
+            raise PyboardError("connection closed by the board")
+        self.buf += self._strip_telnet(self.pending_iac + data)
+
+    def _strip_telnet(self, data):
+        out = bytearray()
+        replies = bytearray()
+        self.pending_iac = b""
+        i = 0
+        while i < len(data):
+            j = data.find(self.IAC, i)
+            if j < 0:
+                out += data[i:]
+                break
+            out += data[i:j]
+            if j + 1 == len(data):
+                self.pending_iac = data[j:]
+                break
+            cmd = data[j + 1]
+            if cmd == self.IAC:
+                out.append(self.IAC)
+                i = j + 2
+            elif cmd in (self.WILL, self.WONT, self.DO, self.DONT):
+                if j + 2 == len(data):
+                    self.pending_iac = data[j:]
+                    break
+                if cmd in (self.WILL, self.DO):
+                    replies += bytes([self.IAC, self.DONT if cmd == self.WILL else self.WONT])
+                    replies.append(data[j + 2])
+                i = j + 3
+            elif cmd == self.SB:
+                end = data.find(bytes([self.IAC, self.SE]), j + 2)
+                if end < 0:
+                    self.pending_iac = data[j:]
+                    break
+                i = end + 2
+            else:
+                i = j + 2
+        if replies:
+            self.sock.sendall(replies)
+        return out
+
+    def _read_past(self, marker):
+        deadline = self._deadline()
+        while marker not in self.buf:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            self._fill(None if deadline is None else deadline - time.time())
+        del self.buf[: self.buf.index(marker) + len(marker)]
+        return True
+
+    def read(self, size=1):
+        deadline = self._deadline()
+        while len(self.buf) < size:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+            self._fill(remaining)
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data
+
+    def write(self, data):
+        self.sock.sendall(data.replace(b"\xff", b"\xff\xff"))
+        return len(data)
+
+    def inWaiting(self):
+        if not self.buf:
+            self._fill(0)
+        return len(self.buf)
+
+    def peek(self):
+        "Return the buffered input without consuming it."
+        return bytes(self.buf)
+
+
 class ProcessToSerial:
     "Execute a process and emulate serial connection using its stdin/stdout."
 
@@ -184,18 +349,45 @@ class ProcessToSerial:
 
         import select
 
+        self.fd = self.subp.stdout.fileno()
+        os.set_blocking(self.fd, False)
         self.poll = select.poll()
-        self.poll.register(self.subp.stdout.fileno())
+        self.poll.register(self.fd)
+        # output is read in bulk into this buffer so that the byte-at-a-time
+        # reads done by Pyboard.read_until don't each cost a system call
+        self.buf = bytearray()
 
     def close(self):
         import signal
 
         os.killpg(os.getpgid(self.subp.pid), signal.SIGTERM)
 
+    def _fill(self, timeout_ms):
+        "Wait up to timeout_ms (None: forever) and read whatever is available."
+        if not self.poll.poll(timeout_ms):
+            return
+        try:
+            data = os.read(self.fd, max(self._pending(), 4096))
+        except BlockingIOError:
+            return
+        if not data:
+            raise PyboardError("process exited")
+        self.buf += data
+
+    def _pending(self):
+        import fcntl
+        import termios
+        import array
+
+        n = array.array("i", [0])
+        fcntl.ioctl(self.fd, termios.FIONREAD, n)
+        return n[0]
+
     def read(self, size=1):
-        data = b""
-        while len(data) < size:
-            data += self.subp.stdout.read(size - len(data))
+        while len(self.buf) < size:
+            self._fill(None)
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
         return data
 
     def write(self, data):
@@ -203,11 +395,13 @@ class ProcessToSerial:
         return len(data)
 
     def inWaiting(self):
-        # res = self.sel.select(0)
-        res = self.poll.poll(0)
-        if res:
-            return 1
-        return 0
+        if not self.buf and self._pending():
+            self._fill(0)
+        return len(self.buf)
+
+    def peek(self):
+        "Return the buffered output without consuming it."
+        return bytes(self.buf)
 
 
 class ProcessPtyToTerminal:
@@ -255,15 +449,635 @@ class ProcessPtyToTerminal:
         return self.ser.inWaiting()
 
 
+class _SerialTap:
+    """Base for wrappers that pass a transport through and note its traffic.
+
+    Consecutive reads are merged into one record, timed at the first of
+    them, while _merges() allows, so byte-at-a-time reads don't cost a
+    record each; the pending read is written out before the next write and
+    on close. Subclasses write records in _record(kind, t, data), kind being
+    b"r" or b"w" and t the seconds since the wrapper was created.
+    """
+
+    def __init__(self, serial):
+        import threading
+
+        self.serial = serial
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.pending_read = None
+        self.last_read = 0
+        if hasattr(serial, "peek"):
+            self.peek = serial.peek
+
+    def _enabled(self):
+        return True
+
+    def _merges(self, now):
+        return True
+
+    def _record(self, kind, t, data):
+        raise NotImplementedError
+
+    def _flush_read(self):
+        if self.pending_read is not None:
+            self._record(b"r", *self.pending_read)
+            self.pending_read = None
+
+    def read(self, size=1):
+        data = self.serial.read(size)
+        if data and self._enabled():
+            with self.lock:
+                now = time.time() - self.start
+                if self.pending_read is None or not self._merges(now):
+                    self._flush_read()
+                    self.pending_read = (now, bytearray())
+                self.pending_read[1].extend(data)
+                self.last_read = now
+        return data
+
+    def write(self, data):
+        if self._enabled():
+            with self.lock:
+                self._flush_read()
+                self._record(b"w", time.time() - self.start, data)
+        return self.serial.write(data)
+
+    def inWaiting(self):
+        return self.serial.inWaiting()
+
+    def close(self):
+        with self.lock:
+            self._flush_read()
+        self.serial.close()
+
+
+class RecordingSerial(_SerialTap):
+    """Wrap a transport and record its traffic to a file for ReplaySerial.
+
+    The file starts with a magic line and holds one record per transfer:
+    a kind byte (b"r" read, b"w" write), the time since the start of the
+    session as a big-endian double, the length as a 32-bit unsigned int
+    and then the data. Reads arriving within a millisecond of each other
+    are merged so byte-at-a-time reads don't bloat the capture.
+    """
+
+    MAGIC = b"PYBREC1\n"
+    RECORD = ">cdI"
+    MERGE_GAP = 0.001
+
+    def __init__(self, serial, path):
+        super().__init__(serial)
+        self.file = open(path, "wb")
+        self.file.write(self.MAGIC)
+
+    def _merges(self, now):
+        return now - self.last_read <= self.MERGE_GAP
+
+    def _record(self, kind, t, data):
+        import struct
+
+        self.file.write(struct.pack(self.RECORD, kind, t, len(data)))
+        self.file.write(data)
+        if kind == b"w":
+            # keep the capture usable even if the session dies
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self._flush_read()
+                self.file.close()
+        self.serial.close()
+
+
+class ReplaySerial:
+    """Play back a session captured by RecordingSerial.
+
+    Recorded output is released to the reader only once the host has
+    written as many bytes as it had when that output arrived, so flushes
+    and prompts behave as they did on the real board. With realtime=True
+    each read is also held back by its original delay after that write,
+    otherwise everything is served as fast as it is asked for. Writes are
+    checked against the recording and a PyboardError is raised as soon as
+    the session diverges from it.
+    """
+
+    def __init__(self, path, realtime=False):
+        import struct
+
+        self.realtime = realtime
+        self.rx = bytearray()
+        self.tx = bytearray()
+        # per read record: (end offset in rx, tx bytes needed, delay after that write)
+        self.marks = []
+        header = struct.calcsize(RecordingSerial.RECORD)
+        last_write = 0
+        with open(path, "rb") as f:
+            if f.read(len(RecordingSerial.MAGIC)) != RecordingSerial.MAGIC:
+                raise PyboardError("%s is not a pyboard recording" % path)
+            while True:
+                rec = f.read(header)
+                if len(rec) < header:
+                    break
+                kind, t, n = struct.unpack(RecordingSerial.RECORD, rec)
+                data = f.read(n)
+                if kind == b"w":
+                    self.tx += data
+                    last_write = t
+                else:
+                    self.rx += data
+                    self.marks.append((len(self.rx), len(self.tx), t - last_write))
+        self.rx_pos = 0
+        self.tx_pos = 0
+        self.released = 0
+        self.next_mark = 0
+        self.write_offsets = [0]
+        self.write_times = [time.time()]
+
+    def close(self):
+        pass
+
+    def _anchor(self, needed):
+        # time at which the host's writes first covered the needed offset
+        import bisect
+
+        return self.write_times[bisect.bisect_left(self.write_offsets, needed)]
+
+    def _release(self):
+        "Release recorded output that is due; return seconds until the next, or None."
+        now = time.time()
+        while self.next_mark < len(self.marks):
+            end, needed, delay = self.marks[self.next_mark]
+            if self.tx_pos < needed:
+                return None
+            if self.realtime:
+                due = self._anchor(needed) + delay
+                if due > now:
+                    return due - now
+            self.released = end
+            self.next_mark += 1
+        return None
+
+    def read(self, size=1):
+        while True:
+            wait = self._release()
+            if self.released - self.rx_pos >= size or wait is None:
+                break
+            time.sleep(wait)
+        end = min(self.rx_pos + size, self.released)
+        data = bytes(self.rx[self.rx_pos : end])
+        self.rx_pos = end
+        return data
+
+    def write(self, data):
+        expected = self.tx[self.tx_pos : self.tx_pos + len(data)]
+        if data != expected:
+            raise PyboardError(
+                "replay diverged from the recording at byte %u written: %r, expected %r"
+                % (self.tx_pos, bytes(data[:32]), bytes(expected[:32]))
+            )
+        self.tx_pos += len(data)
+        self.write_offsets.append(self.tx_pos)
+        self.write_times.append(time.time())
+        return len(data)
+
+    def inWaiting(self):
+        self._release()
+        return self.released - self.rx_pos
+
+    def peek(self):
+        "Return the released output without consuming it."
+        return bytes(self.rx[self.rx_pos : self.released])
+
+
+class LoggingSerial(_SerialTap):
+    """Wrap a transport and log its traffic at DEBUG level.
+
+    Each write is logged as one record on the given logger (by default
+    "pyboard.serial") with the direction and the raw bytes as arguments,
+    so the cost of formatting falls on whichever handler ends up writing
+    it out. Consecutive reads are merged into one record, logged at the
+    next write, when the link goes idle or once MERGE_MAX bytes have
+    built up, so byte-at-a-time reads don't cost a record per byte.
+    Nothing is done while the logger has DEBUG off.
+    """
+
+    MERGE_MAX = 4096
+
+    def __init__(self, serial, logger=None):
+        import logging
+
+        super().__init__(serial)
+        self.logger = logger or logging.getLogger("pyboard.serial")
+        self.debug = logging.DEBUG
+
+    def _enabled(self):
+        return self.logger.isEnabledFor(self.debug)
+
+    def _merges(self, now):
+        return len(self.pending_read[1]) < self.MERGE_MAX
+
+    def _record(self, kind, t, data):
+        self.logger.debug("%s %r", "rx" if kind == b"r" else "tx", bytes(data))
+
+    def inWaiting(self):
+        n = self.serial.inWaiting()
+        if not n and self.pending_read is not None:
+            with self.lock:
+                self._flush_read()
+        return n
+
+
+class BufferedTransport:
+    """Wrap a transport and coalesce writes until the host turns round.
+
+    Pyboard writes a raw REPL frame in pieces (control characters, the
+    command, its EOF); they are kept here and go out as one write at the
+    next read or inWaiting(), when the host starts waiting for the board,
+    or on an explicit flush(). The lock keeps a flush from another thread
+    (e.g. Pyboard.interrupt()) from splitting or reordering writes.
+    stats() counts the writes asked for against those actually made.
+    """
+
+    def __init__(self, serial):
+        import threading
+
+        self.serial = serial
+        self.pending = bytearray()
+        self.lock = threading.Lock()
+        self.logical_writes = 0
+        self.physical_writes = 0
+        self.bytes_written = 0
+        if hasattr(serial, "peek"):
+            self.peek = serial.peek
+
+    def write(self, data):
+        with self.lock:
+            self.pending += data
+            self.logical_writes += 1
+        return len(data)
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            # drop the data even if the write fails, so it isn't retried on close()
+            data = bytes(self.pending)
+            self.pending = bytearray()
+            self.serial.write(data)
+            self.physical_writes += 1
+            self.bytes_written += len(data)
+
+    def read(self, size=1):
+        self.flush()
+        return self.serial.read(size)
+
+    def inWaiting(self):
+        self.flush()
+        return self.serial.inWaiting()
+
+    def stats(self):
+        return {
+            "logical_writes": self.logical_writes,
+            "physical_writes": self.physical_writes,
+            "bytes": self.bytes_written,
+        }
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception:
+            # the link may already be gone (e.g. unplugged); close it regardless
+            pass
+        self.serial.close()
+
+
+class MountSerial:
+    """Wrap a transport and serve a host directory to _mount_code on the board.
+
+    The board's _RemoteFS sends each request as \\x18, a command byte and
+    its arguments in the middle of its normal output; they are taken out
+    of the stream here and answered straight away, so Pyboard only ever
+    sees the normal output. Integers are 4-byte big-endian signed and
+    strings are a length followed by UTF-8; every reply starts with a
+    status that is negative (-errno) on failure.
+    """
+
+    STAT, ILISTDIR, OPEN, READ, CLOSE = 1, 2, 3, 4, 5
+
+    def __init__(self, serial, root):
+        self.serial = serial
+        self.root = os.path.realpath(root)
+        self.buf = bytearray()
+        self.incoming = b""
+        self.files = {}
+        self.next_fd = 1
+
+    def _recv(self, n):
+        data = self.incoming[:n]
+        self.incoming = self.incoming[n:]
+        while len(data) < n:
+            more = self.serial.read(n - len(data))
+            if not more:
+                raise PyboardError("board stopped responding to the mount")
+            data += more
+        return data
+
+    def _recv_int(self):
+        import struct
+
+        return struct.unpack(">i", self._recv(4))[0]
+
+    def _recv_str(self):
+        return str(self._recv(self._recv_int()), "utf8")
+
+    @staticmethod
+    def _pack(*values):
+        import struct
+
+        out = b""
+        for v in values:
+            if isinstance(v, int):
+                out += struct.pack(">i", v)
+            else:
+                v = v.encode("utf8") if isinstance(v, str) else v
+                out += struct.pack(">i", len(v)) + v
+        return out
+
+    def _local(self, path):
+        local = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        if local != self.root and not local.startswith(self.root + os.sep):
+            # don't let ".." or symlinks reach outside the served directory
+            raise OSError(13, "outside of mount", path)
+        return local
+
+    def _handle(self, cmd):
+        import errno
+
+        try:
+            if cmd == self.STAT:
+                local = self._local(self._recv_str())
+                st = os.stat(local)
+                mode = 0x4000 if os.path.isdir(local) else 0x8000
+                reply = self._pack(mode, st.st_size, int(st.st_mtime) & 0x7FFFFFFF)
+            elif cmd == self.ILISTDIR:
+                local = self._local(self._recv_str())
+                names = sorted(os.listdir(local))
+                reply = self._pack(len(names))
+                for name in names:
+                    mode = 0x4000 if os.path.isdir(os.path.join(local, name)) else 0x8000
+                    reply += self._pack(name, mode)
+            elif cmd == self.OPEN:
+                f = open(self._local(self._recv_str()), "rb")
+                fd = self.next_fd
+                self.next_fd += 1
+                self.files[fd] = f
+                reply = self._pack(fd)
+            elif cmd == self.READ:
+                fd = self._recv_int()
+                data = self.files[fd].read(self._recv_int())
+                reply = self._pack(data)
+            elif cmd == self.CLOSE:
+                self.files.pop(self._recv_int()).close()
+                reply = self._pack(0)
+            else:
+                raise PyboardError("unknown mount request %r" % cmd)
+        except OSError as er:
+            reply = self._pack(-(er.errno or errno.EIO))
+        except KeyError:
+            reply = self._pack(-errno.EBADF)
+        self.serial.write(reply)
+
+    def _pump(self, data):
+        self.incoming += data
+        while self.incoming:
+            i = self.incoming.find(b"\x18")
+            if i < 0:
+                self.buf += self.incoming
+                self.incoming = b""
+                break
+            self.buf += self.incoming[:i]
+            self.incoming = self.incoming[i + 1 :]
+            self._handle(self._recv(1)[0])
+
+    def read(self, size=1):
+        while len(self.buf) < size:
+            data = self.serial.read(max(1, min(self.serial.inWaiting(), size - len(self.buf))))
+            if not data:
+                break
+            self._pump(data)
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data
+
+    def write(self, data):
+        return self.serial.write(data)
+
+    def inWaiting(self):
+        n = self.serial.inWaiting()
+        if n:
+            self._pump(self.serial.read(n))
+        return len(self.buf)
+
+    def peek(self):
+        "Return the normal output received so far without consuming it."
+        return bytes(self.buf)
+
+    def close_files(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+    def close(self):
+        self.close_files()
+        self.serial.close()
+
+
+def _write_chunk_command(data):
+    "The command fs_put() sends to write one chunk through the board's w()."
+    if sys.version_info < (3,):
+        return "w(b" + repr(data) + ")"
+    return "w(" + repr(data) + ")"
+
+
+class ChunkSizer:
+    """Chooses the chunk size for chunked transfers.
+
+    A fixed sizer always returns the size it was given. An adaptive one
+    hill-climbs: after every `window` chunks it compares the throughput of
+    the current size with the previous one and keeps stepping in the same
+    direction while throughput improves, turning round when it drops.
+    """
+
+    # a chunk travels as a repr() literal of up to 4 bytes per byte, which the
+    # device compiles into one contiguous allocation; on a fragmented heap free
+    # memory says little about the largest block, so stay well below it
+    MAX_AUTO_SIZE = 4096
+
+    def __init__(self, size=256, min_size=64, max_size=None, window=4, step=1.5):
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.window = window
+        self.step = step
+        self._direction = 1
+        self._rate = None
+        self._count = 0
+        self._bytes = 0
+        self._seconds = 0.0
+
+    @classmethod
+    def from_link_stats(cls, stats, chunk_time_factor=4):
+        """Adaptive sizer tuned to the numbers returned by Pyboard.measure_link().
+
+        The initial size makes moving one chunk take about chunk_time_factor
+        round trips, so per-chunk exec overhead stays a small fraction of the
+        transfer; the maximum is MAX_AUTO_SIZE, less on boards with little
+        free memory.
+        """
+        max_size = max(64, min(stats["mem_free"] // 32, cls.MAX_AUTO_SIZE))
+        rate = min(stats["rate_to_board"], stats["rate_from_board"])
+        size = int(chunk_time_factor * stats["rtt"] * rate)
+        size = max(64, min(max_size, size - size % 64))
+        return cls(size, max_size=max_size)
+
+    def update(self, nbytes, seconds):
+        "Account for a chunk of nbytes that took seconds to move."
+        if self.max_size is None:
+            return
+        self._count += 1
+        self._bytes += nbytes
+        self._seconds += seconds
+        if self._count < self.window:
+            return
+        rate = self._bytes / max(self._seconds, 1e-6)
+        self._count = self._bytes = 0
+        self._seconds = 0.0
+        if self._rate is not None and rate < 0.95 * self._rate:
+            self._direction = -self._direction
+        self._rate = rate
+        size = self.size * self.step if self._direction > 0 else self.size / self.step
+        self.size = max(self.min_size, min(self.max_size, int(size)))
+
+
+class FileCache:
+    """Bounded LRU cache of board file contents, kept on the host.
+
+    Keys are (device_id, path, validator) where the validator changes
+    whenever the file does (its size and mtime, or its hash), so a stale
+    entry can never be hit; writes that the validator may miss (FAT keeps
+    mtimes to 2 s) invalidate the path explicitly. Only the newest entry
+    per device and path is kept, and the least recently used entries are
+    evicted once the cached contents exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        from collections import OrderedDict
+        import threading
+
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # one cache may be shared by boards driven from different threads
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self.invalidate(key[0], key[1])
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.size -= len(old)
+
+    def invalidate(self, device_id, path):
+        "Drop the entries for path; a device_id of None drops them for every device."
+        with self._lock:
+            for key in [
+                k for k in self._entries if k[1] == path and device_id in (None, k[0])
+            ]:
+                self.size -= len(self._entries.pop(key))
+
+
+def _loads_ujson(payload):
+    "json.loads() that also accepts the bare nan and inf that ujson writes for floats."
+    import json
+    import re
+
+    # leave strings alone, rewrite nan/inf outside them as the names json knows
+    payload = re.sub(
+        r'"(?:\\.|[^"\\])*"|\b(nan|inf)\b',
+        lambda m: {"nan": "NaN", "inf": "Infinity"}[m.group(1)] if m.group(1) else m.group(0),
+        payload,
+    )
+    return json.loads(payload)
+
+
+class ClockAlignment:
+    """How a board's utime.ticks_us() relates to the host's time.time().
+
+    Made by Pyboard.align_clocks(): host_ref is the host time at which the
+    board read ticks_ref, taken as the midpoint of the exchange with the
+    shortest round trip rtt, so it is off by at most error = rtt / 2
+    seconds. Drift between the two clocks is not modelled; realign every
+    few minutes for long captures. Ticks wrap at period as on the board.
+    """
+
+    def __init__(self, host_ref, ticks_ref, rtt, period):
+        self.host_ref = host_ref
+        self.ticks_ref = ticks_ref
+        self.rtt = rtt
+        self.error = rtt / 2
+        self.period = period
+
+    def ticks_diff(self, a, b):
+        "Signed difference a - b of two ticks values, like utime.ticks_diff()."
+        half = self.period // 2
+        return (a - b + half) % self.period - half
+
+    def device_ticks(self, host_time=None):
+        "Estimated board ticks_us() at host_time (default: now)."
+        if host_time is None:
+            host_time = time.time()
+        return (self.ticks_ref + round((host_time - self.host_ref) * 1e6)) % self.period
+
+    def host_time(self, ticks):
+        "Host time at which the board's ticks_us() returned ticks (within half a period)."
+        return self.host_ref + self.ticks_diff(ticks, self.ticks_ref) / 1e6
+
+
 class Pyboard:
     def __init__(self, device, baudrate=115200, user="micro", password="python", wait=0):
+        self.device = device
+        self.link_stats = None
+        self.file_cache = FileCache()
+        self._device_id = None
         if device.startswith("exec:"):
             self.serial = ProcessToSerial(device[len("exec:") :])
         elif device.startswith("execpty:"):
             self.serial = ProcessPtyToTerminal(device[len("qemupty:") :])
+        elif device.startswith("replay:"):
+            self.serial = ReplaySerial(device[len("replay:") :])
+        elif device.startswith("replay-realtime:"):
+            self.serial = ReplaySerial(device[len("replay-realtime:") :], realtime=True)
         elif device and device[0].isdigit() and device[-1].isdigit() and device.count(".") == 3:
             # device looks like an IP address
-            self.serial = TelnetToSerial(device, user, password, read_timeout=10)
+            self.serial = SocketToSerial(device, user, password, read_timeout=10)
         else:
             import serial
 
@@ -288,6 +1102,10 @@ class Pyboard:
             if delayed:
                 print("")
 
+        # every transport gets its writes coalesced per frame
+        self.write_buffer = BufferedTransport(self.serial)
+        self.serial = self.write_buffer
+
     def close(self):
         self.serial.close()
 
@@ -303,7 +1121,7 @@ class Pyboard:
             if data.endswith(ending):
                 break
             elif self.serial.inWaiting() > 0:
-                new_data = self.serial.read(1)
+                new_data = self.serial.read(self._read_size(data, ending))
                 if data_consumer:
                     data_consumer(new_data)
                     data = new_data
@@ -317,7 +1135,21 @@ class Pyboard:
                 time.sleep(0.01)
         return data
 
-    def enter_raw_repl(self):
+    def _read_size(self, data, ending):
+        # Transports with an internal buffer let us take everything up to
+        # and including the ending in one read; never read past the ending
+        # as the bytes after it belong to the next read_until.
+        peek = getattr(self.serial, "peek", None)
+        if peek is None:
+            return 1
+        tail = data[max(0, len(data) - len(ending) + 1) :]
+        buffered = peek()
+        idx = (tail + buffered).find(ending)
+        if idx < 0:
+            return max(1, len(buffered))
+        return max(1, idx + len(ending) - len(tail))
+
+    def enter_raw_repl(self, soft_reset=True):
         self.serial.write(b"\r\x03\x03")  # ctrl-C twice: interrupt any running program
 
         # flush input (without relying on serial.flushInput())
@@ -327,16 +1159,17 @@ class Pyboard:
             n = self.serial.inWaiting()
 
         self.serial.write(b"\r\x01")  # ctrl-A: enter raw REPL
-        data = self.read_until(1, b"raw REPL; CTRL-B to exit\r\n>")
-        if not data.endswith(b"raw REPL; CTRL-B to exit\r\n>"):
-            print(data)
-            raise PyboardError("could not enter raw repl")
+        if soft_reset:
+            data = self.read_until(1, b"raw REPL; CTRL-B to exit\r\n>")
+            if not data.endswith(b"raw REPL; CTRL-B to exit\r\n>"):
+                print(data)
+                raise PyboardError("could not enter raw repl")
 
-        self.serial.write(b"\x04")  # ctrl-D: soft reset
-        data = self.read_until(1, b"soft reboot\r\n")
-        if not data.endswith(b"soft reboot\r\n"):
-            print(data)
-            raise PyboardError("could not enter raw repl")
+            self.serial.write(b"\x04")  # ctrl-D: soft reset
+            data = self.read_until(1, b"soft reboot\r\n")
+            if not data.endswith(b"soft reboot\r\n"):
+                print(data)
+                raise PyboardError("could not enter raw repl")
         # By splitting this into 2 reads, it allows boot.py to print stuff,
         # which will show up after the soft reboot and before the raw REPL.
         data = self.read_until(1, b"raw REPL; CTRL-B to exit\r\n")
@@ -346,6 +1179,8 @@ class Pyboard:
 
     def exit_raw_repl(self):
         self.serial.write(b"\r\x02")  # ctrl-B: enter friendly REPL
+        # nothing is read back, so send it now rather than with the next read
+        self.write_buffer.flush()
 
     def follow(self, timeout, data_consumer=None):
         # wait for normal output
@@ -377,10 +1212,13 @@ class Pyboard:
             if not data.endswith(b"."):
                 raise PyboardError("could not enter raw repl")
 
-        # write command
+        # write command, pausing between 256-byte slices so the board keeps
+        # up; the last slice goes out in one write with the EOF
         for i in range(0, len(command_bytes), 256):
+            if i:
+                self.write_buffer.flush()
+                time.sleep(0.01)
             self.serial.write(command_bytes[i : min(i + 256, len(command_bytes))])
-            time.sleep(0.01)
         self.serial.write(b"\x04")
 
         # check if we could exec command
@@ -392,11 +1230,69 @@ class Pyboard:
         self.exec_raw_no_follow(command)
         return self.follow(timeout, data_consumer)
 
+    def exec_streaming(self, command, data_consumer, metrics_consumer=None, interval_ms=2000):
+        """Run a long-lived command with no timeout, streaming its output.
+
+        Output is passed to data_consumer as it arrives rather than being
+        accumulated. The command can be stopped from another thread with
+        interrupt(), after which this returns its KeyboardInterrupt traceback
+        as the error output like any other exception.
+
+        With metrics_consumer, the board also samples its memory every
+        interval_ms while the command runs and each sample is passed to it
+        as a dict like sample_metrics() returns (without the mem_info()
+        fields); the samples are taken out of the output.
+        """
+        if metrics_consumer is not None:
+            if isinstance(command, bytes):
+                command = str(command, "utf8")
+            command = _monitored_exec_code % (interval_ms, interval_ms, repr(command))
+            data_consumer = MetricsSplitter(data_consumer, metrics_consumer)
+        self.exec_raw_no_follow(command)
+        return self.follow(None, data_consumer)
+
+    def interrupt(self):
+        self.serial.write(b"\x03")  # ctrl-C: raise KeyboardInterrupt on the board
+        # don't wait for the next read: the caller may be blocked in one
+        self.write_buffer.flush()
+
     def eval(self, expression):
         ret = self.exec_("print({})".format(expression))
         ret = ret.strip()
         return ret
 
+    def eval_many(self, expressions):
+        """Evaluate several expressions on the board in a single exec.
+
+        Returns a list with one decoded value per expression, in order.
+        Values go over the wire as ujson where possible (so tuples come
+        back as lists) and as repr() otherwise. An expression that raises,
+        or whose value cannot be decoded on the host, gives a
+        PyboardEvalError in its place instead of failing the whole batch.
+        """
+        import ast
+
+        expressions = list(expressions)
+        out = str(self.exec_(_eval_many_code % (expressions,)), "utf8")
+        # anything printed by the expressions themselves precedes its record
+        records = [r.split("\n", 1)[0].rstrip("\r") for r in out.split("\x1e")[1:]]
+        results = []
+        for expression, record in zip(expressions, records):
+            kind, payload = record[:1], record[1:]
+            if kind == "E":
+                results.append(PyboardEvalError(expression, payload))
+            elif kind == "J":
+                try:
+                    results.append(_loads_ujson(payload))
+                except ValueError:
+                    results.append(PyboardEvalError(expression, "cannot decode " + payload))
+            else:
+                try:
+                    results.append(ast.literal_eval(payload))
+                except (ValueError, SyntaxError):
+                    results.append(PyboardEvalError(expression, "cannot decode " + payload))
+        return results
+
     def exec_(self, command, data_consumer=None):
         ret, ret_err = self.exec_raw(command, data_consumer=data_consumer)
         if ret_err:
@@ -408,9 +1304,92 @@ class Pyboard:
             pyfile = f.read()
         return self.exec_(pyfile)
 
+    def exec_timed(self, command, data_consumer=None):
+        """Like exec_, but the device also times the command with ticks_ms.
+
+        The duration is reported as "exec_ms" by the next sample_metrics()
+        call in the same raw REPL session.
+        """
+        if isinstance(command, bytes):
+            command = str(command, "utf8")
+        return self.exec_(_timed_exec_code % repr(command), data_consumer=data_consumer)
+
+    def sample_metrics(self):
+        """Collect the board's memory and timing metrics in one exec.
+
+        Returns a dict with "mem_free", "mem_alloc" and "ticks_ms", plus
+        "max_free_block" (in bytes) and "stack_used" when micropython.mem_info()
+        reports them and "exec_ms" if exec_timed() ran in this session (else
+        None).
+        """
+        import re
+
+        out = str(self.exec_(_sample_metrics_code), "utf8")
+        first, rest = out.split("\n", 1)
+        mem_free, mem_alloc, ticks_ms, exec_ms, block_size = (int(x) for x in first.split())
+        metrics = {
+            "mem_free": mem_free,
+            "mem_alloc": mem_alloc,
+            "ticks_ms": ticks_ms,
+            "exec_ms": None if exec_ms < 0 else exec_ms,
+            "max_free_block": None,
+            "stack_used": None,
+        }
+        m = re.search(r"max free sz: (\d+)", rest)
+        if m:
+            metrics["max_free_block"] = int(m.group(1)) * block_size
+        m = re.search(r"stack: (\d+)", rest)
+        if m:
+            metrics["stack_used"] = int(m.group(1))
+        return metrics
+
     def get_time(self):
-        t = str(self.eval("pyb.RTC().datetime()"), encoding="utf8")[1:-1].split(", ")
-        return int(t[4]) * 3600 + int(t[5]) * 60 + int(t[6])
+        (t,) = self.eval_many(["pyb.RTC().datetime()"])
+        if isinstance(t, PyboardEvalError):
+            raise t
+        return t[4] * 3600 + t[5] * 60 + t[6]
+
+    def align_clocks(self, samples=16):
+        """Align the board's utime.ticks_us() with the host clock (in raw REPL).
+
+        The board answers each of samples one-byte requests with its ticks
+        as soon as the byte arrives, NTP-style; the exchange with the
+        shortest round trip bounds the error best and is the one kept.
+        Returns a ClockAlignment.
+        """
+        self.exec_raw_no_follow(_clock_sync_code % samples)
+        line = self.read_until(1, b"\n")
+        if line.startswith(b"\x04"):
+            ret_err = line[1:] + self.read_until(1, b"\x04")
+            raise PyboardError("exception", b"", ret_err[:-1])
+        period = int(line) + 1
+        best = None
+        for _ in range(samples):
+            sent = time.time()
+            self.serial.write(b"\x00")
+            # stop the clock on the first byte: read_until may poll for the rest
+            first = self.serial.read(1)
+            received = time.time()
+            ticks = int(first + self.read_until(1, b"\n"))
+            if best is None or received - sent < best[1] - best[0]:
+                best = (sent, received, ticks)
+        self.follow(10)
+        sent, received, ticks = best
+        return ClockAlignment((sent + received) / 2, ticks, received - sent, period)
+
+    def benchmark(self, code, runs=10):
+        """Time code on the board, compiling it once and running it runs times.
+
+        Each run gets fresh globals and follows a gc.collect(). Returns a dict
+        with the raw per-run "us" (utime.ticks_us) and "alloc" (change in
+        gc.mem_alloc, which is negative if a collection ran mid-run) lists.
+        """
+        import ast
+
+        if isinstance(code, bytes):
+            code = str(code, "utf8")
+        us, alloc = ast.literal_eval(str(self.exec_(_bench_code % (code, runs)), "ascii"))
+        return {"us": us, "alloc": alloc}
 
     def fs_ls(self, src):
         cmd = (
@@ -420,40 +1399,204 @@ class Pyboard:
         )
         self.exec_(cmd, data_consumer=stdout_write_bytes)
 
+    def measure_link(self, probe_size=1024, samples=3):
+        """Measure the link and the board's free memory (in raw REPL).
+
+        Returns and stores in self.link_stats a dict with the exec round-trip
+        time "rtt" in seconds, the throughputs "rate_to_board" and
+        "rate_from_board" in bytes/s, and "mem_free" after a collection.
+        rate_to_board is timed with the command fs_put() sends per chunk,
+        including the pacing between its 256-byte slices.
+        """
+
+        def timed(command):
+            start = time.time()
+            ret = self.exec_(command)
+            return time.time() - start, ret
+
+        rtt = min(timed("pass")[0] for _ in range(samples))
+        mem_free = int(timed("import gc\ngc.collect()\nprint(gc.mem_free())")[1])
+        # w() is a sink here; fs_put() binds it to the open file's write()
+        self.exec_("w=len")
+        probe = _write_chunk_command(b"a" * probe_size)
+        to_board = min(timed(probe)[0] for _ in range(samples))
+        from_board = min(timed("print('a'*%u)" % probe_size)[0] for _ in range(samples))
+        self.link_stats = {
+            "rtt": rtt,
+            "mem_free": mem_free,
+            "rate_to_board": probe_size / max(to_board - rtt, 1e-6),
+            "rate_from_board": probe_size / max(from_board - rtt, 1e-6),
+        }
+        return self.link_stats
+
+    def chunk_sizer(self, chunk_size):
+        """Return a ChunkSizer for a chunk_size argument of the fs_* methods.
+
+        chunk_size is either a number of bytes or "auto", which measures the
+        link on first use (see measure_link) and adapts during transfers.
+        """
+        if isinstance(chunk_size, ChunkSizer):
+            return chunk_size
+        if chunk_size == "auto":
+            return ChunkSizer.from_link_stats(self.link_stats or self.measure_link())
+        return ChunkSizer(int(chunk_size))
+
     def fs_cat(self, src, chunk_size=256):
         cmd = (
             "with open('%s') as f:\n while 1:\n"
-            "  b=f.read(%u)\n  if not b:break\n  print(b,end='')" % (src, chunk_size)
+            "  b=f.read(%u)\n  if not b:break\n  print(b,end='')"
+            % (src, self.chunk_sizer(chunk_size).size)
         )
         self.exec_(cmd, data_consumer=stdout_write_bytes)
 
-    def fs_get(self, src, dest, chunk_size=256):
+    def fs_get(self, src, dest, chunk_size=256, verify=False, use_cache=False):
+        if use_cache:
+            data = self.fs_read(src, chunk_size, verify=verify, use_cache=True)
+            with open(dest, "wb") as f:
+                f.write(data)
+            return
+        sizer = self.chunk_sizer(chunk_size)
         self.exec_("f=open('%s','rb')\nr=f.read" % src)
+        if verify:
+            import hashlib
+
+            h = hashlib.sha256()
+            # hash each chunk on the device as it is read
+            self.exec_(_hash_read_code)
         with open(dest, "wb") as f:
             while True:
                 data = bytearray()
-                self.exec_("print(r(%u))" % chunk_size, data_consumer=lambda d: data.extend(d))
+                start = time.time()
+                self.exec_("print(r(%u))" % sizer.size, data_consumer=lambda d: data.extend(d))
                 assert data.endswith(b"\r\n\x04")
                 data = eval(str(data[:-3], "ascii"))
+                sizer.update(len(data), time.time() - start)
                 if not data:
                     break
                 f.write(data)
+                if verify:
+                    h.update(data)
         self.exec_("f.close()")
+        if verify:
+            self._check_digest(src, h.hexdigest())
+
+    def fs_read(self, src, chunk_size=256, verify=False, use_cache=False, validator="stat"):
+        """Return the contents of a board file as bytes, streamed in one exec.
+
+        With use_cache, the file is looked up in self.file_cache first, keyed
+        by device_id() and fs_validator(src, validator), and stored there
+        after a transfer.
+        """
+        if use_cache:
+            key = (self.device_id(), src, self.fs_validator(src, validator))
+            data = self.file_cache.get(key)
+            if data is not None:
+                return data
+        import binascii
+
+        cmd = (
+            "import ubinascii\nwith open('%s','rb') as f:\n while 1:\n"
+            "  b=f.read(%u)\n  if not b:break\n%s"
+            "  print(ubinascii.b2a_base64(b).decode(),end='')\n"
+            % (src, self.chunk_sizer(chunk_size).size, "  _h.update(b)\n" if verify else "")
+        )
+        if verify:
+            import hashlib
+
+            cmd = "import uhashlib\n_h=uhashlib.sha256()\n" + cmd
+        # one base64 line per chunk; some ports end lines with a bare "\n"
+        data = b"".join(binascii.a2b_base64(line) for line in self.exec_(cmd).split())
+        if verify:
+            self._check_digest(src, hashlib.sha256(data).hexdigest())
+        if use_cache:
+            self.file_cache.put(key, data)
+        return data
 
-    def fs_put(self, src, dest, chunk_size=256):
+    def device_id(self):
+        "Return the board's machine.unique_id() in hex, or the device name if unavailable."
+        if self._device_id is None:
+            try:
+                self._device_id = str(
+                    self.exec_(
+                        "import machine, ubinascii\n"
+                        "print(ubinascii.hexlify(machine.unique_id()).decode())"
+                    ),
+                    "ascii",
+                ).strip()
+            except PyboardError:
+                self._device_id = self.device
+        return self._device_id
+
+    def fs_stat(self, src):
+        import ast
+
+        stat = self.exec_("import uos\nprint(uos.stat('%s'))" % src)
+        return ast.literal_eval(str(stat, "ascii"))
+
+    def fs_validator(self, src, validator="stat"):
+        """Return a cheap value that changes when the board file src changes.
+
+        "stat" gives (size, mtime), which needs no read of the file but
+        cannot see same-size rewrites within the filesystem's mtime
+        resolution; "hash" gives the SHA-256 computed on the device.
+        """
+        if validator == "hash":
+            return self.fs_hash(src)
+        st = self.fs_stat(src)
+        return (st[6], st[8])
+
+    def fs_put(self, src, dest, chunk_size=256, verify=False):
+        sizer = self.chunk_sizer(chunk_size)
         self.exec_("import os")
         self.exec_("f=open('%s','wb')\nw=f.write" % dest)
+        if verify:
+            import hashlib
+
+            h = hashlib.sha256()
+            # hash each chunk on the device as it is written
+            self.exec_(_hash_write_code)
         with open(src, "rb") as f:
             while True:
-                data = f.read(chunk_size)
+                data = f.read(sizer.size)
                 if not data:
                     break
-                if sys.version_info < (3,):
-                    self.exec_("w(b" + repr(data) + ")")
-                else:
-                    self.exec_("w(" + repr(data) + ")")
+                if verify:
+                    h.update(data)
+                start = time.time()
+                self.exec_(_write_chunk_command(data))
+                if sys.version_info >= (3,):
                     self.exec_("if hasattr(os, 'sync'):\n    os.sync()")
+                sizer.update(len(data), time.time() - start)
         self.exec_("f.close()")
+        self.file_cache.invalidate(self._device_id, dest)
+        if verify:
+            self._check_digest(dest, h.hexdigest())
+
+    def _check_digest(self, path, host_digest):
+        board_digest = str(self.exec_(_hash_hexdigest_code), "ascii").strip()
+        if board_digest != host_digest:
+            raise PyboardChecksumError(path, host_digest, board_digest)
+
+    def fs_hash(self, src, chunk_size=256):
+        "Return the hex SHA-256 of a file on the board, hashed on the device."
+        cmd = (
+            "import uhashlib\n_h=uhashlib.sha256()\nwith open('%s','rb') as f:\n while 1:\n"
+            "  b=f.read(%u)\n  if not b:break\n  _h.update(b)\n"
+            % (src, self.chunk_sizer(chunk_size).size)
+        )
+        return str(self.exec_(cmd + _hash_hexdigest_code), "ascii").strip()
+
+    def fs_verify(self, src, dest, chunk_size=256):
+        """Check that local file src matches file dest on the board.
+
+        Returns the common hex digest or raises PyboardChecksumError.
+        """
+        chunk_size = self.chunk_sizer(chunk_size).size
+        host_digest = file_hash(src, chunk_size)
+        board_digest = self.fs_hash(dest, chunk_size)
+        if board_digest != host_digest:
+            raise PyboardChecksumError(dest, host_digest, board_digest)
+        return host_digest
 
     def fs_mkdir(self, dir):
         self.exec_("import uos\nuos.mkdir('%s')" % dir)
@@ -463,6 +1606,213 @@ class Pyboard:
 
     def fs_rm(self, src):
         self.exec_("import uos\nuos.remove('%s')" % src)
+        self.file_cache.invalidate(self._device_id, src)
+
+    def exec_with_input(self, command, stream, block_size=256, timeout=10):
+        """Execute command while feeding it the bytes produced by stream.
+
+        The command reads its input with the helpers in _input_blocks_code:
+        the device asks for each block with an ACK byte and the host answers
+        with exactly block_size bytes (the last block is zero-padded), so the
+        device's receive buffer can never overflow and no input is left over
+        if the command fails part way through. Each request, like the output
+        after the last one, must arrive within timeout seconds.
+        """
+        self.exec_raw_no_follow(_input_blocks_code % block_size + command)
+        blocks = _split_blocks(stream, block_size)
+        while True:
+            # the port has no read timeout, so a stalled or reset board would
+            # block a bare read(1) for ever
+            deadline = time.time() + timeout
+            while not self.serial.inWaiting():
+                if time.time() > deadline:
+                    raise PyboardError("timeout waiting for the device to request input")
+                time.sleep(0.001)
+            c = self.serial.read(1)
+            if c != b"\x06":
+                break
+            self.serial.write(next(blocks, bytes(block_size)))
+
+        # the command has finished, so c starts its normal output
+        if c == b"\x04":
+            ret = b""
+        else:
+            ret = self.read_until(1, b"\x04", timeout=timeout)
+            if not ret.endswith(b"\x04"):
+                raise PyboardError("timeout waiting for first EOF reception")
+            ret = c + ret[:-1]
+        ret_err = self.read_until(1, b"\x04", timeout=timeout)
+        if not ret_err.endswith(b"\x04"):
+            raise PyboardError("timeout waiting for second EOF reception")
+        ret_err = ret_err[:-1]
+        if ret_err:
+            raise PyboardError("exception", ret, ret_err)
+        return ret
+
+    def fs_put_bundle(self, src, dest, chunk_size=256, files=None):
+        """Upload the directory tree src to dest in a single exec.
+
+        The tree is packed on the fly with pack_bundle() and unpacked on the
+        device as it streams in, so each file costs a few header bytes instead
+        of a full open/write/close round trip. If files is given only those
+        paths (relative to src, "/"-separated) are sent.
+        """
+        self.fs_put_entries(bundle_entries(src, files), dest, chunk_size)
+
+    def fs_put_entries(self, entries, dest, chunk_size=256):
+        "Upload bundle entries (see bundle_entries()) below dest in a single exec."
+        chunk_size = self.chunk_sizer(chunk_size).size
+        self.exec_with_input(
+            _bundle_unpack_code % (dest.rstrip("/"), chunk_size),
+            pack_bundle(entries, chunk_size),
+            chunk_size,
+        )
+
+    def mount_local(self, path, mount_point="/remote", block_size=256):
+        """Mount the host directory path on the board, read-only, in raw REPL.
+
+        The board's working directory moves to mount_point, so following
+        commands import and open files straight from path; each open file
+        reads ahead block_size bytes per request. Lasts until umount_local()
+        or a soft reset.
+        """
+        self.serial = MountSerial(self.serial, path)
+        self.exec_(_mount_code % (block_size, mount_point, mount_point))
+        self._mount_point = mount_point
+
+    def umount_local(self):
+        "Undo mount_local()."
+        try:
+            self.exec_("import uos\nuos.chdir('/')\nuos.umount(%r)" % self._mount_point)
+        finally:
+            self.serial.close_files()
+            self.serial = self.serial.serial
+
+    def fs_grep(self, pattern, paths=("",), regex=False, max_line=256, match_consumer=None):
+        """Search board files for lines containing pattern, in one exec.
+
+        paths may name files or directories, which are searched recursively
+        ("" is the current directory). Files are read on the device with
+        readline(max_line), so memory use stays bounded and only matching
+        lines are sent back; a longer line is searched in max_line pieces.
+        With regex, pattern is a ure regular expression. Returns a list of
+        (path, line number, line) with the line as bytes, and also passes
+        each one to match_consumer as it arrives.
+        """
+        import ast
+
+        if isinstance(pattern, str):
+            pattern = pattern.encode("utf8")
+        matches = []
+        pending = [b""]
+
+        def consumer(data):
+            lines = (pending[0] + data.replace(b"\x04", b"")).split(b"\n")
+            pending[0] = lines.pop()
+            for line in lines:
+                path, lineno, text = str(line.rstrip(b"\r"), "utf8").split("\t", 2)
+                match = (path, int(lineno), ast.literal_eval(text))
+                matches.append(match)
+                if match_consumer:
+                    match_consumer(match)
+
+        self.exec_(_grep_code % (list(paths), pattern, regex, max_line), data_consumer=consumer)
+        return matches
+
+    def fs_hashes(self, paths, chunk_size=256):
+        "Return the hex SHA-256 of each board file in paths (None if missing), in one exec."
+        out = self.exec_(_hash_files_code % (list(paths), self.chunk_sizer(chunk_size).size))
+        return [None if h == "-" else h for h in str(out, "ascii").split()]
+
+    def fs_snapshot(self, archive, src="", chunk_size=256):
+        """Save the board's tree under src to the local tar file archive.
+
+        The whole tree is walked and streamed in one exec, base64-encoded and
+        hashed on the device. The archive holds the files by their path
+        relative to src plus a MANIFEST.json with each file's size and
+        SHA-256; it is gzipped if its name ends in "gz". Returns the manifest.
+        """
+        import tarfile
+
+        mode = "w:gz" if archive.endswith("gz") else "w"
+        with tarfile.open(archive, mode) as tar:
+            writer = _SnapshotWriter(tar, self.device)
+            self.exec_(
+                _snapshot_code % (src.rstrip("/"), self.chunk_sizer(chunk_size).size),
+                data_consumer=writer.feed,
+            )
+            return writer.finish()
+
+    def fs_restore(self, archive, dest="", chunk_size=256, verify=False):
+        """Copy the files of a fs_snapshot() archive back to dest on the board.
+
+        Files whose SHA-256 on the board already matches the manifest are
+        skipped, the rest are sent in a single bundle. Returns the list of
+        files sent.
+        """
+        import json
+        import tarfile
+
+        prefix = dest.rstrip("/") + "/" if dest.rstrip("/") else ""
+        with tarfile.open(archive) as tar:
+            try:
+                manifest = json.load(tar.extractfile("MANIFEST.json"))
+            except KeyError:
+                raise PyboardError("%s has no MANIFEST.json" % archive)
+            files = manifest["files"]
+            names = sorted(files)
+            board = self.fs_hashes([prefix + name for name in names], chunk_size)
+            changed = [name for name, h in zip(names, board) if h != files[name]["sha256"]]
+            entries = [("D", name) for name in manifest["dirs"]]
+            for name in changed:
+                member = tar.getmember(name)
+                entries.append(("F", name, member.size, lambda m=member: tar.extractfile(m)))
+            self.fs_put_entries(entries, dest, chunk_size)
+        for name in changed:
+            self.file_cache.invalidate(self._device_id, prefix + name)
+        if verify and changed:
+            board = self.fs_hashes([prefix + name for name in changed], chunk_size)
+            for name, h in zip(changed, board):
+                if h != files[name]["sha256"]:
+                    raise PyboardChecksumError(prefix + name, files[name]["sha256"], h)
+        return changed
+
+    def fs_put_delta(self, src, dest, block_size=512, chunk_size=256, verify=False):
+        """Update dest on the board to match local file src, sending only changes.
+
+        The device reports a weak checksum and a truncated SHA-256 of each
+        block_size block of the current dest in one exec; the host looks for
+        those blocks at any offset in src with delta_ops() and streams copy
+        instructions for them plus the remaining bytes. The device rebuilds the
+        file as dest + ".tmp" and renames it over dest. Returns the number of
+        literal bytes sent.
+        """
+        import hashlib
+
+        chunk_size = self.chunk_sizer(chunk_size).size
+        out = str(self.exec_(_delta_sums_code % (dest, block_size)), "ascii").split()
+        old_size = int(out[0]) if out else 0
+        sums = [(int(weak, 16), digest) for weak, digest in zip(out[1::2], out[2::2])]
+        with open(src, "rb") as f:
+            data = f.read()
+        ops = delta_ops(data, sums, old_size, block_size)
+        self.exec_with_input(
+            _delta_apply_code % (dest, block_size, verify),
+            pack_delta(data, ops, chunk_size),
+            chunk_size,
+        )
+        self.file_cache.invalidate(self._device_id, dest)
+        if verify:
+            self._check_digest(dest, hashlib.sha256(data).hexdigest())
+        return sum(n for kind, _, n in ops if kind == "D")
+
+    def reimport(self, modules, data_consumer=None):
+        """Drop modules from sys.modules on the board and import them again.
+
+        Runs without a timeout, as importing may start the program. Returns
+        the (output, error output) pair of the exec.
+        """
+        return self.exec_streaming(_reimport_code % (list(modules),), data_consumer)
 
 
 # in Python2 exec is a keyword so one must use "exec_"
@@ -479,7 +1829,16 @@ def execfile(filename, device="/dev/ttyACM0", baudrate=115200, user="micro", pas
     pyb.close()
 
 
-def filesystem_command(pyb, args):
+def filesystem_command(
+    pyb,
+    args,
+    verify=False,
+    chunk_size=256,
+    use_cache=False,
+    delta=False,
+    regex=False,
+    recursive=False,
+):
     def fname_remote(src):
         if src.startswith(":"):
             src = src[1:]
@@ -498,25 +1857,72 @@ def filesystem_command(pyb, args):
     cmd = args[0]
     args = args[1:]
     try:
-        if cmd == "cp":
+        if cmd == "verify":
+            src, dest = args[0], fname_remote(args[1])
+            print("verify %s :%s" % (src, dest))
+            print("ok %s" % pyb.fs_verify(src, dest, chunk_size))
+        elif cmd == "grep":
+            pattern, paths = args[0], [fname_remote(src) for src in args[1:]] or [""]
+            pyb.fs_grep(
+                pattern,
+                paths,
+                regex=regex,
+                match_consumer=lambda m: stdout_write_bytes(
+                    ("%s:%u:" % m[:2]).encode("utf8") + m[2].rstrip(b"\r\n") + b"\n"
+                ),
+            )
+        elif cmd == "snapshot":
+            archive, src = args[0], fname_remote(args[1]) if len(args) > 1 else ""
+            print("snapshot :%s %s" % (src, archive))
+            manifest = pyb.fs_snapshot(archive, src, chunk_size)
+            print(
+                "%u files, %u bytes"
+                % (len(manifest["files"]), sum(f["size"] for f in manifest["files"].values()))
+            )
+        elif cmd == "restore":
+            archive, dest = args[0], fname_remote(args[1]) if len(args) > 1 else ""
+            print("restore %s :%s" % (archive, dest))
+            changed = pyb.fs_restore(archive, dest, chunk_size, verify=verify)
+            for name in changed:
+                print("sent %s" % name)
+            print("%u files sent" % len(changed))
+        elif cmd == "cp" and recursive:
+            # recursive copy to the board as a single bundle
+            srcs = args[:-1]
+            dest = fname_remote(args[-1])
+            for src in srcs:
+                src = src.rstrip("/")
+                dest2 = fname_cp_dest(src, dest)
+                print("cp -r %s :%s" % (src, dest2))
+                pyb.fs_put_bundle(src, dest2, chunk_size)
+        elif cmd == "cp":
             srcs = args[:-1]
             dest = args[-1]
             if srcs[0].startswith("./") or dest.startswith(":"):
                 op = pyb.fs_put
+                if delta:
+                    op = lambda src, dest, **kw: print(
+                        "sent %u of %u bytes"
+                        % (pyb.fs_put_delta(src, dest, **kw), os.path.getsize(src))
+                    )
                 fmt = "cp %s :%s"
                 dest = fname_remote(dest)
             else:
-                op = pyb.fs_get
+                op = lambda src, dest, **kw: pyb.fs_get(src, dest, use_cache=use_cache, **kw)
                 fmt = "cp :%s %s"
             for src in srcs:
                 src = fname_remote(src)
                 dest2 = fname_cp_dest(src, dest)
                 print(fmt % (src, dest2))
-                op(src, dest2)
+                op(src, dest2, chunk_size=chunk_size, verify=verify)
         else:
             op = {
                 "ls": pyb.fs_ls,
-                "cat": pyb.fs_cat,
+                "cat": lambda src: (
+                    stdout_write_bytes(pyb.fs_read(src, chunk_size, use_cache=True))
+                    if use_cache
+                    else pyb.fs_cat(src, chunk_size)
+                ),
                 "mkdir": pyb.fs_mkdir,
                 "rmdir": pyb.fs_rmdir,
                 "rm": pyb.fs_rm,
@@ -528,40 +1934,1352 @@ def filesystem_command(pyb, args):
                 print("%s :%s" % (cmd, src))
                 op(src)
     except PyboardError as er:
-        print(str(er.args[2], "ascii"))
+        if len(er.args) > 2:
+            print(str(er.args[2], "ascii"))
+        else:
+            print(er)
         pyb.exit_raw_repl()
         pyb.close()
         sys.exit(1)
 
 
-_injected_import_hook_code = """\
-import uos, uio
-class _FS:
-  class File(uio.IOBase):
-    def __init__(self):
-      self.off = 0
-    def ioctl(self, request, arg):
-      return 0
-    def readinto(self, buf):
-      buf[:] = memoryview(_injected_buf)[self.off:self.off + len(buf)]
-      self.off += len(buf)
-      return len(buf)
-  mount = umount = chdir = lambda *args: None
-  def stat(self, path):
-    if path == '_injected.mpy':
-      return tuple(0 for _ in range(10))
-    else:
-      raise OSError(-2) # ENOENT
-  def open(self, path, mode):
-    return self.File()
-uos.mount(_FS(), '/_')
-uos.chdir('/_')
-from _injected import *
+def file_hash(path, chunk_size=256):
+    "Return the hex SHA-256 of a local file."
+    import hashlib
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+def _split_blocks(stream, block_size):
+    pending = bytearray()
+    for data in stream:
+        pending += data
+        while len(pending) >= block_size:
+            yield bytes(pending[:block_size])
+            del pending[:block_size]
+    if pending:
+        yield bytes(pending) + bytes(block_size - len(pending))
+
+
+def bundle_entries(src, files=None):
+    """Yield the bundle entries for the directory tree rooted at src.
+
+    Directories are ("D", name) and files are ("F", name, size, opener),
+    with names relative to src, "/"-separated, and parents before children.
+    If files is given only those files and their parent directories are
+    included.
+    """
+    if files is not None:
+        made = set()
+        for name in sorted(files):
+            parts = name.split("/")
+            for i in range(1, len(parts)):
+                parent = "/".join(parts[:i])
+                if parent not in made:
+                    made.add(parent)
+                    yield ("D", parent)
+            path = os.path.join(src, *parts)
+            yield ("F", name, os.path.getsize(path), lambda path=path: open(path, "rb"))
+        return
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        rel = os.path.relpath(root, src).replace(os.sep, "/")
+        prefix = "" if rel == "." else rel + "/"
+        if prefix:
+            yield ("D", rel)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield ("F", prefix + name, os.path.getsize(path), lambda path=path: open(path, "rb"))
+
+
+def pack_bundle(entries, chunk_size=256):
+    """Serialise bundle entries into the stream read by _bundle_unpack_code.
+
+    Each record is a kind byte (D, F or E for the end), a 2-byte name length
+    and the UTF-8 name; F records are followed by a 4-byte size and the file
+    contents. All integers are big endian.
+    """
+    import struct
+
+    for entry in entries:
+        kind, name = entry[0], entry[1].encode("utf8")
+        yield kind.encode("ascii") + struct.pack(">H", len(name)) + name
+        if kind == "F":
+            yield struct.pack(">I", entry[2])
+            with entry[3]() as f:
+                while True:
+                    data = f.read(chunk_size)
+                    if not data:
+                        break
+                    yield data
+    yield b"E\x00\x00"
+
+
+class DirectoryWatcher:
+    """Poll a host directory tree for added and modified files.
+
+    Files are compared by the mtime and size from os.stat; hidden entries,
+    editor backups ending in "~" and __pycache__ are skipped. Changes are
+    reported only once the tree has been still for debounce seconds, so a
+    burst of saves comes out as one batch.
+    """
+
+    def __init__(self, root, interval=0.1, debounce=0.25):
+        self.root = root
+        self.interval = interval
+        self.debounce = debounce
+        self.snapshot = self.scan()
+        self.last_scan = self.snapshot
+        self.last_change = 0
+
+    def scan(self):
+        snapshot = {}
+        for root, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith(".") and d != "__pycache__"]
+            rel = os.path.relpath(root, self.root).replace(os.sep, "/")
+            prefix = "" if rel == "." else rel + "/"
+            for name in files:
+                if name.startswith(".") or name.endswith("~"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    # removed while scanning
+                    continue
+                snapshot[prefix + name] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def poll(self):
+        "Return the files changed since the last report, or [] if none or still changing."
+        scan = self.scan()
+        now = time.time()
+        if scan != self.last_scan:
+            self.last_scan = scan
+            self.last_change = now
+        if now - self.last_change < self.debounce:
+            return []
+        changed = sorted(name for name, st in scan.items() if self.snapshot.get(name) != st)
+        self.snapshot = scan
+        return changed
+
+    def wait(self):
+        "Block until some files have changed and return them."
+        while True:
+            changed = self.poll()
+            if changed:
+                return changed
+            time.sleep(self.interval)
+
+
+def module_names(paths):
+    "Return the module names for the .py/.mpy files among paths relative to an import root."
+    names = []
+    for path in paths:
+        base, ext = os.path.splitext(path)
+        if ext not in (".py", ".mpy"):
+            continue
+        if base == "__init__":
+            continue
+        if base.endswith("/__init__"):
+            base = base[: -len("/__init__")]
+        names.append(base.replace("/", "."))
+    return names
+
+
+def watch_directory(pyb, src, dest="", chunk_size=256, reload=False):
+    """Push files changed under src to dest on the board until ctrl-C.
+
+    The raw REPL is entered without a soft reset and kept for the whole
+    session. With reload, changed modules (named by their path relative
+    to src) are imported again after each push.
+    """
+    watcher = DirectoryWatcher(src)
+    pyb.enter_raw_repl(soft_reset=False)
+    print("watching %s, ctrl-C to stop" % src)
+    try:
+        while True:
+            changed = watcher.wait()
+            start = time.time()
+            try:
+                pyb.fs_put_bundle(src, dest, chunk_size, files=changed)
+            except (PyboardError, OSError) as er:
+                print("push failed: %s" % (er,))
+                continue
+            print("pushed %s in %.2fs" % (", ".join(changed), time.time() - start))
+            modules = module_names(changed) if reload else []
+            if modules:
+                try:
+                    ret, ret_err = pyb.reimport(modules, data_consumer=stdout_write_bytes)
+                except KeyboardInterrupt:
+                    # stop the program on the board, then go back to watching
+                    pyb.interrupt()
+                    ret, ret_err = pyb.follow(timeout=10, data_consumer=stdout_write_bytes)
+                stdout_write_bytes(ret_err)
+    except KeyboardInterrupt:
+        pass
+    pyb.exit_raw_repl()
+
+
+def bench_stats(result):
+    "Return the min, median and p95 time in us and the median allocation of a benchmark() result."
+
+    def median(values):
+        values = sorted(values)
+        mid = len(values) // 2
+        return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+    us = sorted(result["us"])
+    return {
+        "min": us[0],
+        "median": median(us),
+        # nearest-rank percentile
+        "p95": us[max(0, -(-len(us) * 95 // 100) - 1)],
+        "alloc": median(result["alloc"]),
+    }
+
+
+def bench_command(pyb, args):
+    """Benchmark the -c command and files of args, printing a summary of each.
+
+    With args.bench_output the raw timings are saved as JSON, and with
+    args.bench_compare each summary is compared with the same benchmark in
+    such a file, e.g. from an earlier build or another board.
+    """
+    import json
+
+    sources = []
+    if args.command is not None:
+        sources.append(("-c", args.command))
+    for filename in args.files:
+        with open(filename, "rb") as f:
+            sources.append((filename, f.read()))
+    baseline = {}
+    if args.bench_compare:
+        with open(args.bench_compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for name, code in sources:
+        try:
+            results[name] = result = pyb.benchmark(code, args.bench_runs)
+        except PyboardError as er:
+            if len(er.args) > 2:
+                stdout_write_bytes(er.args[2])
+            else:
+                print(er)
+            pyb.exit_raw_repl()
+            pyb.close()
+            sys.exit(1)
+        stats = bench_stats(result)
+        print(
+            "%s: %u runs, min %u us, median %u us, p95 %u us, alloc %d bytes"
+            % (
+                name,
+                len(result["us"]),
+                stats["min"],
+                stats["median"],
+                stats["p95"],
+                stats["alloc"],
+            )
+        )
+        if name in baseline:
+            old = bench_stats(baseline[name])
+            print(
+                "  vs %s: "
+                % args.bench_compare
+                + ", ".join(
+                    "%s %+.1f%%" % (key, 100.0 * (stats[key] - old[key]) / old[key])
+                    if old[key]
+                    else "%s %+d" % (key, stats[key] - old[key])
+                    for key in ("min", "median", "p95", "alloc")
+                )
+            )
+
+    if args.bench_output:
+        with open(args.bench_output, "w") as f:
+            json.dump({"device": pyb.device, "runs": args.bench_runs, "results": results}, f)
+
+
+class MetricsSplitter:
+    """data_consumer wrapper that takes the samples of _monitored_exec_code out of the output.
+
+    A sample is \\x1d, "M", three numbers and a newline, and may be split
+    across chunks; it is passed to metrics_consumer as a dict and
+    everything else to data_consumer. A \\x1d that doesn't start a
+    well-formed sample is the program's own output and is passed on as is.
+    """
+
+    def __init__(self, data_consumer, metrics_consumer):
+        import re
+
+        self.data_consumer = data_consumer
+        self.metrics_consumer = metrics_consumer
+        self.frame = None
+        self.frame_re = re.compile(rb"M(\d+) (\d+) (\d+)\r?")
+        # what may still turn into a sample once the rest arrives
+        self.partial_re = re.compile(rb"(M[\d ]{0,40}\r?)?")
+
+    def __call__(self, data):
+        out = b""
+        while data:
+            if self.frame is None:
+                i = data.find(b"\x1d")
+                if i < 0:
+                    out += data
+                    break
+                out += data[:i]
+                data = data[i + 1 :]
+                self.frame = b""
+            i = data.find(b"\n")
+            end = len(data) if i < 0 else i
+            self.frame += data[:end]
+            data = data[end:]
+            # data is empty or starts with the newline ending the frame
+            match = (self.frame_re if data else self.partial_re).fullmatch(self.frame)
+            if match is None:
+                # look again from just after the \x1d, which may start a sample
+                out += b"\x1d"
+                data = self.frame + data
+                self.frame = None
+            elif data:
+                self.sample(match)
+                self.frame = None
+                data = data[1:]
+        if out:
+            self.data_consumer(out)
+
+    def sample(self, match):
+        mem_free, mem_alloc, ticks_ms = (int(x) for x in match.groups())
+        self.metrics_consumer(
+            {
+                "mem_free": mem_free,
+                "mem_alloc": mem_alloc,
+                "ticks_ms": ticks_ms,
+                "exec_ms": None,
+                "max_free_block": None,
+                "stack_used": None,
+            }
+        )
+
+
+class TimestampedOutput:
+    """data_consumer wrapper that stamps each line of board output.
+
+    A line gets the host time of day at which the chunk starting it was
+    received and, once alignment (a ClockAlignment) is set, the board's
+    estimated ticks_us() at that moment, so it can be compared with ticks
+    values printed by the program itself.
+    """
+
+    def __init__(self, data_consumer, alignment=None):
+        self.data_consumer = data_consumer
+        self.alignment = alignment
+        self.line_start = True
+
+    def stamp(self, now):
+        stamp = "[%s.%06d" % (time.strftime("%H:%M:%S", time.localtime(now)), now % 1 * 1e6)
+        if self.alignment is not None:
+            stamp += " dev %10u" % self.alignment.device_ticks(now)
+        return bytes(stamp + "] ", "ascii")
+
+    def __call__(self, data):
+        now = time.time()
+        data = data.replace(b"\x04", b"")
+        if not data:
+            return
+        stamp = self.stamp(now)
+        out = b""
+        for line in data.splitlines(True):
+            if self.line_start:
+                out += stamp
+            out += line
+            self.line_start = line.endswith(b"\n")
+        self.data_consumer(out)
+
+
+class _SnapshotWriter:
+    "Parses the output of _snapshot_code as it streams in and adds it to a tar file."
+
+    def __init__(self, tar, device):
+        self.tar = tar
+        self.manifest = {"device": device, "time": time.time(), "dirs": [], "files": {}}
+        self.pending = b""
+        self.file = None
+        self.errors = []
+
+    def feed(self, data):
+        lines = (self.pending + data.replace(b"\x04", b"")).split(b"\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self.line(str(line.rstrip(b"\r"), "utf8"))
+
+    def line(self, line):
+        import binascii
+        import hashlib
+        import io
+        import tarfile
+
+        if self.file is not None and not line.startswith("H "):
+            self.file[1].extend(binascii.a2b_base64(line))
+        elif line.startswith("D "):
+            name = line[2:]
+            self.manifest["dirs"].append(name)
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = self.manifest["time"]
+            self.tar.addfile(info)
+        elif line.startswith("F "):
+            self.file = (line.split(" ", 2)[2], bytearray())
+        elif line.startswith("H "):
+            name, data = self.file
+            self.file = None
+            digest = hashlib.sha256(data).hexdigest()
+            if digest != line[2:]:
+                # raised once the exec is over, so the board isn't left mid-command
+                self.errors.append(PyboardChecksumError(name, digest, line[2:]))
+            self.manifest["files"][name] = {"size": len(data), "sha256": digest}
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = self.manifest["time"]
+            self.tar.addfile(info, io.BytesIO(data))
+
+    def finish(self):
+        import io
+        import json
+        import tarfile
+
+        if self.errors:
+            raise self.errors[0]
+        data = json.dumps(self.manifest, indent=1, sort_keys=True).encode("utf8")
+        info = tarfile.TarInfo("MANIFEST.json")
+        info.size = len(data)
+        info.mtime = self.manifest["time"]
+        self.tar.addfile(info, io.BytesIO(data))
+        return self.manifest
+
+
+def _block_digest(data):
+    import hashlib
+
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def _weak_sum(data):
+    # rsync's rolling checksum: the byte sum and the sum of the running sums,
+    # each mod 2**16; see delta_ops() for how it rolls
+    s1 = s2 = 0
+    for x in data:
+        s1 += x
+        s2 += s1
+    return s1 & 0xFFFF, s2 & 0xFFFF
+
+
+def delta_ops(data, sums, old_size, block_size):
+    """Return the operations that rebuild data from the old file's blocks.
+
+    sums are the (_weak_sum() packed as s2 << 16 | s1, _block_digest()) of
+    each block_size block of the old file of old_size bytes. Operations are
+    ("C", offset, n) to copy n bytes of the old file and ("D", offset, n) to
+    send n bytes of data; adjacent copies are merged. As in rsync, the weak
+    checksum is rolled over data a byte at a time and only offsets whose weak
+    checksum matches a block are confirmed with the digest, so blocks are
+    found at any offset in data; the old file's short last block is only
+    looked for at the end of data.
+    """
+    blocks = {}
+    for i, (weak, digest) in enumerate(sums):
+        if (i + 1) * block_size <= old_size:
+            blocks.setdefault(weak, {}).setdefault(digest, i * block_size)
+    ops = []
+
+    def emit(kind, offset, n):
+        if n == 0:
+            return
+        if ops and ops[-1][0] == kind and ops[-1][1] + ops[-1][2] == offset:
+            ops[-1] = (kind, offset - ops[-1][2], ops[-1][2] + n)
+        else:
+            ops.append((kind, offset, n))
+
+    literal = 0
+    i = 0
+    s1, s2 = _weak_sum(data[:block_size])
+    while i + block_size <= len(data):
+        candidates = blocks.get(s2 << 16 | s1)
+        if candidates:
+            offset = candidates.get(_block_digest(data[i : i + block_size]))
+            if offset is not None:
+                emit("D", literal, i - literal)
+                emit("C", offset, block_size)
+                i += block_size
+                literal = i
+                s1, s2 = _weak_sum(data[i : i + block_size])
+                continue
+        if i + block_size < len(data):
+            # slide the window one byte: drop data[i], take in data[i + block_size]
+            out, new = data[i], data[i + block_size]
+            s1 = (s1 - out + new) & 0xFFFF
+            s2 = (s2 - block_size * out + s1) & 0xFFFF
+        i += 1
+    tail = old_size % block_size
+    if tail and sums and len(data) - tail >= literal:
+        if _block_digest(data[len(data) - tail :]) == sums[-1][1]:
+            emit("D", literal, len(data) - tail - literal)
+            emit("C", old_size - tail, tail)
+            literal = len(data)
+    emit("D", literal, len(data) - literal)
+    return ops
+
+
+def pack_delta(data, ops, chunk_size=256):
+    """Serialise delta_ops() into the stream read by _delta_apply_code.
+
+    Each record is a kind byte (C, D or E for the end) followed by a 4-byte
+    offset and a 4-byte length, big endian; D records are followed by the
+    bytes themselves.
+    """
+    import struct
+
+    for kind, offset, n in ops:
+        yield kind.encode("ascii") + struct.pack(">II", offset, n)
+        if kind == "D":
+            for i in range(offset, offset + n, chunk_size):
+                yield data[i : min(i + chunk_size, offset + n)]
+    yield b"E" + bytes(8)
+
+
+_timed_exec_code = """\
+import utime as _ut
+_mon_t0=_ut.ticks_ms()
+try:
+ exec(%s)
+finally:
+ _mon_dt=_ut.ticks_diff(_ut.ticks_ms(),_mon_t0)
+"""
+
+# the GC block is 4 words on all ports; mem_info() counts free space in blocks
+_sample_metrics_code = """\
+import gc, micropython, utime
+try:
+ import ustruct as _s
+except ImportError:
+ import struct as _s
+print(gc.mem_free(), gc.mem_alloc(), utime.ticks_ms(), globals().get('_mon_dt', -1),
+ 4 * _s.calcsize('P'))
+micropython.mem_info()
+"""
+
+# timed like _timed_exec_code, printing a \x1d-framed memory sample every %u ms
+# from a soft timer or, failing that, a thread; _mon_on holds [sampling, thread
+# stopped], and the sampler is stopped before the final sample so none follows it
+_monitored_exec_code = """\
+import gc, micropython, usys, utime as _ut
+def _mon_sample(_=None):
+ usys.stdout.write('\\x1dM%%u %%u %%u\\n' %% (gc.mem_free(), gc.mem_alloc(), _ut.ticks_ms()))
+def _mon_tick(_):
+ if _mon_on[0]:
+  _mon_sample()
+_mon_on = [True, True]
+_mon_timer = None
+try:
+ from machine import Timer
+ _mon_timer = Timer(-1)
+ _mon_timer.init(period=%u, callback=lambda t: micropython.schedule(_mon_tick, 0))
+except Exception:
+ _mon_timer = None
+ try:
+  import _thread
+  def _mon_loop(on, ms):
+   t = _ut.ticks_ms()
+   while on[0]:
+    _ut.sleep_ms(10)
+    if on[0] and _ut.ticks_diff(_ut.ticks_ms(), t) >= ms:
+     t = _ut.ticks_add(t, ms)
+     _mon_sample()
+   on[1] = True
+  _mon_on[1] = False
+  _thread.start_new_thread(_mon_loop, (_mon_on, %u))
+ except Exception:
+  _mon_on[1] = True
+_mon_sample()
+_mon_t0=_ut.ticks_ms()
+try:
+ exec(%s)
+finally:
+ _mon_dt=_ut.ticks_diff(_ut.ticks_ms(),_mon_t0)
+ _mon_on[0] = False
+ if _mon_timer:
+  _mon_timer.deinit()
+ while not _mon_on[1]:
+  _ut.sleep_ms(1)
+ _mon_sample()
+"""
+
+# one \x1e-prefixed record per expression: E error, J ujson, R repr
+_eval_many_code = """\
+try:
+ import ujson as _j
+except ImportError:
+ _j=None
+for _s in %r:
+ try:
+  _v=eval(_s)
+ except Exception as _e:
+  print('\\x1eE%%s: %%s'%%(type(_e).__name__,_e))
+  continue
+ try:
+  print('\\x1eJ'+_j.dumps(_v))
+ except Exception:
+  print('\\x1eR'+repr(_v))
+"""
+
+# wrap the r/w helpers of fs_get/fs_put so every chunk also feeds _h
+_hash_read_code = """\
+import uhashlib
+_h=uhashlib.sha256()
+_r=r
+def r(n):
+ b=_r(n)
+ _h.update(b)
+ return b
+"""
+
+_hash_write_code = """\
+import uhashlib
+_h=uhashlib.sha256()
+_w=w
+def w(b):
+ _h.update(b)
+ return _w(b)
+"""
+
+_hash_hexdigest_code = "import ubinascii\nprint(ubinascii.hexlify(_h.digest()).decode())"
+
+# _rd(n) returns the next n bytes of the input sent by Pyboard.exec_with_input
+_input_blocks_code = """\
+import usys, micropython
+micropython.kbd_intr(-1)
+_rb = b''
+_ro = 0
+def _rd(n):
+  global _rb, _ro
+  b = b''
+  while len(b) < n:
+    if _ro == len(_rb):
+      usys.stdout.write('\\x06')
+      _rb = usys.stdin.buffer.read(%u)
+      _ro = 0
+    k = min(n - len(b), len(_rb) - _ro)
+    b += _rb[_ro:_ro + k]
+    _ro += k
+  return b
+"""
+
+_bundle_unpack_code = """\
+import uos
+def _mk(p):
+  try:
+    uos.mkdir(p)
+  except OSError:
+    pass
+def _unpack(d, bs):
+  if d:
+    _mk(d)
+  while 1:
+    h = _rd(3)
+    p = _rd(h[1] << 8 | h[2]).decode()
+    if d:
+      p = d + '/' + p
+    if h[0] == 69:
+      break
+    elif h[0] == 68:
+      _mk(p)
+    elif h[0] == 70:
+      n = int.from_bytes(_rd(4), 'big')
+      with open(p, 'wb') as f:
+        while n:
+          b = _rd(min(n, bs))
+          f.write(b)
+          n -= len(b)
+    else:
+      raise ValueError('bad bundle record')
+_unpack(%r, %u)
+"""
+
+# the timings and allocation deltas of each run, printed as two lists
+_bench_code = """\
+import gc, utime
+def _bench(s, n):
+  try:
+    c = compile(s, '<bench>', 'exec')
+  except NameError:
+    # no compile() on this port, exec the source each time
+    c = s
+  us = []
+  al = []
+  for i in range(n):
+    g = {'__name__': '__bench__'}
+    gc.collect()
+    a = gc.mem_alloc()
+    t = utime.ticks_us()
+    exec(c, g)
+    t = utime.ticks_diff(utime.ticks_us(), t)
+    al.append(gc.mem_alloc() - a)
+    us.append(t)
+  print((us, al))
+_bench(%r, %u)
+"""
+
+# the ticks period less one, then the ticks as soon as each request byte arrives
+_clock_sync_code = """\
+import usys, utime, micropython
+micropython.kbd_intr(-1)
+print(utime.ticks_add(0, -1))
+for _ in range(%u):
+  usys.stdin.buffer.read(1)
+  print(utime.ticks_us())
+micropython.kbd_intr(3)
+"""
+
+# a D line per directory and per file an F line, base64 lines and an H line;
+# names are relative to the directory snapshotted
+_snapshot_code = """\
+import uos, uhashlib, ubinascii
+def _snap(d, bs, r):
+  for e in list(uos.ilistdir(d) if d else uos.ilistdir()):
+    p = d + '/' + e[0] if d else e[0]
+    n = r + '/' + e[0] if r else e[0]
+    if e[1] & 0x4000:
+      print('D', n)
+      _snap(p, bs, n)
+      continue
+    h = uhashlib.sha256()
+    with open(p, 'rb') as f:
+      print('F', f.seek(0, 2), n)
+      f.seek(0)
+      while 1:
+        b = f.read(bs)
+        if not b:
+          break
+        h.update(b)
+        print(ubinascii.b2a_base64(b).decode(), end='')
+    print('H', ubinascii.hexlify(h.digest()).decode())
+_snap(%r, %u, '')
+"""
+
+# a path<TAB>line number<TAB>repr(line) line per match
+_grep_code = """\
+import uos
+def _grep_file(p, m, n):
+  k = 1
+  with open(p, 'rb') as f:
+    while 1:
+      l = f.readline(n)
+      if not l:
+        break
+      if m(l):
+        print('%%s\\t%%d\\t%%r' %% (p, k, l))
+      if l[-1] == 10:
+        k += 1
+def _grep(ps, m, n):
+  for p in ps:
+    if p and not uos.stat(p)[0] & 0x4000:
+      _grep_file(p, m, n)
+      continue
+    d = p if not p or p[-1] == '/' else p + '/'
+    _grep([d + e[0] for e in (uos.ilistdir(p) if p else uos.ilistdir())], m, n)
+def _matcher(pat, rx):
+  if rx:
+    try:
+      import ure
+    except ImportError:
+      import re as ure
+    return ure.compile(pat).search
+  return lambda l: pat in l
+_grep(%r, _matcher(%r, %r), %u)
+"""
+
+_hash_files_code = """\
+import uhashlib, ubinascii
+def _hashes(ps, bs):
+  for p in ps:
+    try:
+      f = open(p, 'rb')
+    except OSError:
+      print('-')
+      continue
+    h = uhashlib.sha256()
+    with f:
+      while 1:
+        b = f.read(bs)
+        if not b:
+          break
+        h.update(b)
+    print(ubinascii.hexlify(h.digest()).decode())
+_hashes(%r, %u)
+"""
+
+# the size of a file, then the weak checksum (see _weak_sum()) and the
+# truncated SHA-256 of each of its blocks
+_delta_sums_code = """\
+import uhashlib, ubinascii
+def _sums(p, bs):
+  try:
+    f = open(p, 'rb')
+  except OSError:
+    return
+  with f:
+    print(f.seek(0, 2))
+    f.seek(0)
+    while 1:
+      b = f.read(bs)
+      if not b:
+        break
+      s1 = s2 = 0
+      for x in b:
+        s1 += x
+        s2 += s1
+      h = ubinascii.hexlify(uhashlib.sha256(b).digest()[:8]).decode()
+      print('%%08x' %% ((s2 & 0xffff) << 16 | s1 & 0xffff), h)
+_sums(%r, %u)
+"""
+
+# rebuild a file from the records of pack_delta(), then swap it in
+_delta_apply_code = """\
+import uos, uhashlib
+def _apply(p, bs, v):
+  global _h
+  _h = uhashlib.sha256()
+  t = p + '.tmp'
+  try:
+    s = open(p, 'rb')
+  except OSError:
+    s = None
+  with open(t, 'wb') as f:
+    while 1:
+      h = _rd(9)
+      if h[0] == 69:
+        break
+      o = int.from_bytes(h[1:5], 'big')
+      n = int.from_bytes(h[5:9], 'big')
+      if h[0] == 67:
+        s.seek(o)
+      elif h[0] != 68:
+        raise ValueError('bad delta record')
+      while n:
+        b = s.read(min(n, bs)) if h[0] == 67 else _rd(min(n, bs))
+        f.write(b)
+        if v:
+          _h.update(b)
+        n -= len(b)
+  if s:
+    s.close()
+  try:
+    uos.rename(t, p)
+  except OSError:
+    # FAT will not rename over an existing file
+    uos.remove(p)
+    uos.rename(t, p)
+_apply(%r, %u, %r)
+"""
+
+_reimport_code = """\
+import usys
+for _m in %r:
+ usys.modules.pop(_m, None)
+ __import__(_m)
+"""
+
+# read-only VFS whose requests are answered by MountSerial on the host
+_mount_code = """\
+import uos, uio, usys, micropython
+class _RemoteCmd:
+  def __init__(s):
+    s.fin = usys.stdin.buffer
+    s.fout = usys.stdout.buffer
+  def wr(s, *a):
+    for x in a:
+      if isinstance(x, int):
+        s.fout.write((x & 0xffffffff).to_bytes(4, 'big'))
+      else:
+        x = x.encode()
+        s.wr(len(x))
+        s.fout.write(x)
+  def rd(s):
+    i = int.from_bytes(s.fin.read(4), 'big')
+    return i - 0x100000000 if i & 0x80000000 else i
+  def rd_bytes(s, n):
+    return s.fin.read(n) if n else b''
+  def req(s, c, *a):
+    # no ctrl-C until the reply is complete: it may contain 0x03 bytes
+    micropython.kbd_intr(-1)
+    s.fout.write(bytes([0x18, c]))
+    s.wr(*a)
+    r = s.rd()
+    if r < 0:
+      s.end()
+      raise OSError(-r)
+    return r
+  def end(s):
+    micropython.kbd_intr(3)
+class _RemoteFile(uio.IOBase):
+  def __init__(s, c, fd, text, bs):
+    s.c = c
+    s.fd = fd
+    s.text = text
+    s.bs = bs
+    s.buf = b''
+    s.off = 0
+  def readinto(s, b):
+    if s.off == len(s.buf):
+      # read ahead at least a block, so small reads don't each cost a request
+      c = s.c
+      s.buf = c.rd_bytes(c.req(4, s.fd, max(len(b), s.bs)))
+      c.end()
+      s.off = 0
+    n = min(len(b), len(s.buf) - s.off)
+    b[:n] = s.buf[s.off:s.off + n]
+    s.off += n
+    return n
+  def _out(s, b):
+    return str(b, 'utf8') if s.text else bytes(b)
+  def read(s, n=-1):
+    out = bytearray()
+    b = bytearray(s.bs)
+    while n < 0 or len(out) < n:
+      k = s.readinto(memoryview(b)[:s.bs if n < 0 else min(s.bs, n - len(out))])
+      if not k:
+        break
+      out += b[:k]
+    return s._out(out)
+  def readline(s):
+    out = bytearray()
+    b = bytearray(1)
+    while s.readinto(b):
+      out += b
+      if b[0] == 10:
+        break
+    return s._out(out)
+  def __iter__(s):
+    return s
+  def __next__(s):
+    l = s.readline()
+    if not l:
+      raise StopIteration
+    return l
+  def ioctl(s, req, arg):
+    if req == 4:
+      s.close()
+    return 0
+  def close(s):
+    if s.fd:
+      s.c.req(5, s.fd)
+      s.c.end()
+      s.fd = 0
+  def __enter__(s):
+    return s
+  def __exit__(s, *a):
+    s.close()
+class _RemoteFS:
+  def __init__(s, bs):
+    s.c = _RemoteCmd()
+    s.bs = bs
+    s.path = '/'
+  def mount(s, readonly, mkfs):
+    pass
+  def umount(s):
+    pass
+  def chdir(s, p):
+    s.path = s._abs(p).rstrip('/') + '/'
+  def getcwd(s):
+    return s.path.rstrip('/') or '/'
+  def _abs(s, p):
+    return p if p.startswith('/') else s.path + p
+  def stat(s, p):
+    c = s.c
+    m = c.req(1, s._abs(p))
+    n = c.rd()
+    t = c.rd()
+    c.end()
+    return (m, 0, 0, 0, 0, 0, n, t, t, t)
+  def ilistdir(s, p):
+    c = s.c
+    k = c.req(2, s._abs(p))
+    l = []
+    for i in range(k):
+      n = c.rd_bytes(c.rd()).decode()
+      l.append((n, c.rd(), 0))
+    c.end()
+    return iter(l)
+  def open(s, p, mode):
+    if 'w' in mode or 'a' in mode or '+' in mode:
+      raise OSError(30)
+    fd = s.c.req(3, s._abs(p))
+    s.c.end()
+    return _RemoteFile(s.c, fd, 'b' not in mode, s.bs)
+uos.mount(_RemoteFS(%u), %r)
+uos.chdir(%r)
+"""
+
+_injected_import_hook_code = """\
+import uos, uio
+class _FS:
+  class File(uio.IOBase):
+    def __init__(self):
+      self.off = 0
+    def ioctl(self, request, arg):
+      return 0
+    def readinto(self, buf):
+      buf[:] = memoryview(_injected_buf)[self.off:self.off + len(buf)]
+      self.off += len(buf)
+      return len(buf)
+  mount = umount = chdir = lambda *args: None
+  def stat(self, path):
+    if path == '_injected.mpy':
+      return tuple(0 for _ in range(10))
+    else:
+      raise OSError(-2) # ENOENT
+  def open(self, path, mode):
+    return self.File()
+uos.mount(_FS(), '/_')
+uos.chdir('/_')
+from _injected import *
 uos.umount('/_')
 del _injected_buf, _FS
 """
 
 
+def run_commands(pyb, args):
+    output = stdout_write_bytes
+    if args.timestamps:
+        output = TimestampedOutput(stdout_write_bytes)
+
+    # run any command or file(s)
+    if args.command is not None or args.filesystem or len(args.files):
+        # we must enter raw-REPL mode to execute commands
+        # this will do a soft-reset of the board
+        try:
+            pyb.enter_raw_repl()
+        except PyboardError as er:
+            print(er)
+            pyb.close()
+            sys.exit(1)
+
+        # stamp the output with board time as well as host time
+        if args.timestamps:
+            try:
+                output.alignment = pyb.align_clocks()
+            except PyboardError as er:
+                print(er)
+                pyb.close()
+                sys.exit(1)
+            sys.stderr.write(
+                "board clock aligned to within %.3f ms\n" % (output.alignment.error * 1000)
+            )
+
+        # serve a host directory to the board while the commands run
+        if args.mount:
+            try:
+                pyb.mount_local(args.mount, args.mount_point)
+            except PyboardError as er:
+                print(er)
+                pyb.close()
+                sys.exit(1)
+
+        def execbuffer(buf):
+            try:
+                if args.no_follow:
+                    pyb.exec_raw_no_follow(buf)
+                    ret_err = None
+                else:
+                    ret, ret_err = pyb.exec_streaming(buf, data_consumer=output)
+            except PyboardError as er:
+                print(er)
+                pyb.close()
+                sys.exit(1)
+            except KeyboardInterrupt:
+                # stop the program on the board as well and show where it was;
+                # a second ctrl-C abandons waiting for the traceback
+                pyb.interrupt()
+                try:
+                    ret, ret_err = pyb.follow(timeout=10, data_consumer=output)
+                    stdout_write_bytes(ret_err)
+                except (PyboardError, KeyboardInterrupt):
+                    pass
+                sys.exit(1)
+            if ret_err:
+                pyb.exit_raw_repl()
+                pyb.close()
+                stdout_write_bytes(ret_err)
+                sys.exit(1)
+
+        # do filesystem commands, if given
+        if args.filesystem:
+            filesystem_command(
+                pyb,
+                args.files,
+                verify=args.verify,
+                chunk_size=args.chunk_size,
+                use_cache=args.cache,
+                delta=args.delta,
+                regex=args.regex,
+                recursive=args.recursive,
+            )
+            del args.files[:]
+
+        if args.bench:
+            # time the command and files instead of running them once
+            bench_command(pyb, args)
+        else:
+            # run the command, if given
+            if args.command is not None:
+                execbuffer(args.command.encode("utf-8"))
+
+            # run any files
+            for filename in args.files:
+                with open(filename, "rb") as f:
+                    pyfile = f.read()
+                    if filename.endswith(".mpy") and pyfile[0] == ord("M"):
+                        pyb.exec_("_injected_buf=" + repr(pyfile))
+                        pyfile = _injected_import_hook_code
+                    execbuffer(pyfile)
+
+        if args.mount:
+            pyb.umount_local()
+
+        # exiting raw-REPL just drops to friendly-REPL mode
+        pyb.exit_raw_repl()
+
+    # if asked explicitly, or no files given, then follow the output
+    if args.follow or (args.command is None and not args.filesystem and len(args.files) == 0):
+        try:
+            ret, ret_err = pyb.follow(timeout=None, data_consumer=output)
+        except PyboardError as er:
+            print(er)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            sys.exit(1)
+        if ret_err:
+            pyb.close()
+            stdout_write_bytes(ret_err)
+            sys.exit(1)
+
+
+class _DaemonSession:
+    """Pyboard stand-in handed to requests served by the daemon.
+
+    The daemon owns the connection and keeps the board in raw REPL between
+    requests, so a request may neither leave raw REPL (which would force a
+    soft reset on the next one) nor close the connection.
+    """
+
+    def __init__(self, pyb):
+        self._pyb = pyb
+
+    def __getattr__(self, name):
+        return getattr(self._pyb, name)
+
+    def enter_raw_repl(self):
+        pass
+
+    def exit_raw_repl(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _DaemonWriter:
+    "File-like object forwarding str/bytes output of a request to the client socket."
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = bytes(data, "utf8")
+        if data:
+            _daemon_send_frame(self.conn, b"o", data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def _daemon_send_frame(conn, tag, payload):
+    import struct
+
+    conn.sendall(tag + struct.pack(">I", len(payload)) + payload)
+
+
+def _daemon_recv_exact(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError
+    return data
+
+
+# options a request can't change: they configure the daemon's own connection
+_daemon_fixed_options = (
+    ("device", "-d/--device"),
+    ("baudrate", "-b/--baudrate"),
+    ("user", "-u/--user"),
+    ("password", "-p/--password"),
+    ("daemon", "--daemon"),
+    ("watch", "--watch"),
+    ("record", "--record"),
+    ("stats", "--stats"),
+)
+
+
+def _serve_daemon_request(conn, session, cmd_parser):
+    import argparse
+    import json
+    import struct
+    import contextlib
+
+    f = conn.makefile("rb")
+    size = struct.unpack(">I", _daemon_recv_exact(f, 4))[0]
+    request = json.loads(_daemon_recv_exact(f, size).decode("utf8"))
+
+    writer = _DaemonWriter(conn)
+    saved_stdout = stdout
+    saved_cwd = os.getcwd()
+    code = 0
+    try:
+        reset_stdout(writer)
+        with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(writer):
+            args = cmd_parser.parse_intermixed_args(request["argv"])
+            # argparse leaves attributes that are already set alone, so after
+            # this parse only the options given on the command line are not None
+            given = cmd_parser.parse_intermixed_args(
+                request["argv"],
+                argparse.Namespace(**{dest: None for dest, _ in _daemon_fixed_options}),
+            )
+            for dest, option in _daemon_fixed_options:
+                value = getattr(given, dest)
+                if value is None or (dest == "device" and value == session.device):
+                    continue
+                print(
+                    "%s is not supported through the daemon (serving %s)"
+                    % (option, session.device)
+                )
+                sys.exit(1)
+            if args.follow or (
+                args.command is None and not args.filesystem and len(args.files) == 0
+            ):
+                print("nothing to run: following output is not supported through the daemon")
+                sys.exit(1)
+            os.chdir(request["cwd"])
+            run_commands(session, args)
+    except SystemExit as er:
+        if isinstance(er.code, int) or er.code is None:
+            code = er.code or 0
+        else:
+            code = 1
+    except Exception as er:
+        # e.g. the client went away in the middle of a command
+        print("daemon request failed: %r" % er)
+        code = 1
+    finally:
+        reset_stdout(saved_stdout)
+        os.chdir(saved_cwd)
+
+    try:
+        _daemon_send_frame(conn, b"x", str(code).encode("ascii"))
+    except OSError:
+        pass
+    return code
+
+
+def serve_daemon(pyb, socket_path, cmd_parser):
+    """Serve requests from thin pyboard.py clients over a Unix socket.
+
+    The board is put in raw REPL once, so every request skips opening the
+    port and the soft reset that enter_raw_repl() performs.
+    """
+    import socket
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        # nobody listening, so any existing file is a stale socket
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    else:
+        raise PyboardError("a daemon is already listening on " + socket_path)
+    finally:
+        probe.close()
+
+    pyb.enter_raw_repl()
+    session = _DaemonSession(pyb)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(4)
+    print("pyboard daemon listening on %s" % socket_path)
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    code = _serve_daemon_request(conn, session, cmd_parser)
+                except (OSError, EOFError, ValueError):
+                    # malformed request or client hung up before sending one
+                    continue
+                if code:
+                    # the board may be mid-command or in an unknown state,
+                    # so interrupt it and start from a clean raw REPL
+                    pyb.enter_raw_repl()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(socket_path)
+        pyb.exit_raw_repl()
+
+
+def daemon_client(socket_path, argv):
+    """Forward a pyboard.py command line to a running daemon.
+
+    Output is relayed to stdout as it arrives; returns the exit code.
+    """
+    import json
+    import socket
+    import struct
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except OSError as er:
+        print("could not connect to pyboard daemon at %s: %s" % (socket_path, er))
+        return 1
+    request = json.dumps({"argv": argv, "cwd": os.getcwd()}).encode("utf8")
+    out = getattr(sys.stdout, "buffer", sys.stdout)
+    with conn:
+        conn.sendall(struct.pack(">I", len(request)) + request)
+        f = conn.makefile("rb")
+        try:
+            while True:
+                header = _daemon_recv_exact(f, 5)
+                payload = _daemon_recv_exact(f, struct.unpack(">I", header[1:])[0])
+                if header[:1] == b"x":
+                    return int(payload)
+                out.write(payload)
+                out.flush()
+        except EOFError:
+            print("pyboard daemon closed the connection")
+            return 1
+
+
 def main():
     import argparse
 
@@ -602,8 +3320,117 @@ def main():
     cmd_parser.add_argument(
         "-f", "--filesystem", action="store_true", help="perform a filesystem action"
     )
+    cmd_parser.add_argument(
+        "-r",
+        "--recursive",
+        action="store_true",
+        help="with -f cp, copy host directories to the board (-f cp -r DIR :DEST)",
+    )
+    cmd_parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check the SHA-256 of files copied with -f cp or -f restore on both ends",
+    )
+    cmd_parser.add_argument(
+        "--bench",
+        action="store_true",
+        help="benchmark the command and files on the board instead of running them once",
+    )
+    cmd_parser.add_argument(
+        "--bench-runs", type=int, default=10, metavar="N", help="number of timed runs for --bench"
+    )
+    cmd_parser.add_argument(
+        "--bench-output", metavar="FILE", help="save the raw --bench timings to FILE as JSON"
+    )
+    cmd_parser.add_argument(
+        "--bench-compare",
+        metavar="FILE",
+        help="compare --bench results with a --bench-output FILE (another build or board)",
+    )
+    cmd_parser.add_argument(
+        "--regex",
+        action="store_true",
+        help="treat the -f grep pattern as a regular expression (ure) instead of a substring",
+    )
+    cmd_parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="-f cp to the board sends only the blocks that differ from the file already there",
+    )
+    cmd_parser.add_argument(
+        "--chunk-size",
+        default="256",
+        help="chunk size in bytes for -f transfers, or 'auto' to measure the link and adapt",
+    )
+    cmd_parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="serve unchanged files for -f cp/cat from a host-side cache (kept by --daemon)",
+    )
+    cmd_parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep the connection open and serve commands from clients on --socket",
+    )
+    cmd_parser.add_argument(
+        "-s",
+        "--socket",
+        default=os.environ.get("PYBOARD_SOCKET"),
+        help="Unix socket of a pyboard daemon; if given, send the command to the daemon",
+    )
+    cmd_parser.add_argument(
+        "--watch",
+        metavar="DIR",
+        help="push files changed in DIR to the board until ctrl-C (no soft reset)",
+    )
+    cmd_parser.add_argument(
+        "--watch-dest",
+        default="",
+        metavar="PATH",
+        help="board directory that --watch pushes to (default: the root)",
+    )
+    cmd_parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="with --watch, re-import changed modules after each push",
+    )
+    cmd_parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="record the serial traffic to FILE; play it back with -d replay:FILE",
+    )
+    cmd_parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print how many serial writes were asked for and how many were made",
+    )
+    cmd_parser.add_argument(
+        "--timestamps",
+        action="store_true",
+        help="prefix each output line with the host time it arrived and, when a command "
+        "or file is run, the board's estimated utime.ticks_us() at that moment",
+    )
+    cmd_parser.add_argument(
+        "--mount",
+        metavar="DIR",
+        help="mount DIR read-only on the board (and cd to it) while running the command and files",
+    )
+    cmd_parser.add_argument(
+        "--mount-point",
+        default="/remote",
+        metavar="PATH",
+        help="where --mount puts DIR on the board (default: /remote)",
+    )
     cmd_parser.add_argument("files", nargs="*", help="input files")
-    args = cmd_parser.parse_args()
+    # intermixed, so options may follow filesystem arguments (-f cp -r DIR :DEST)
+    args = cmd_parser.parse_intermixed_args()
+
+    # hand the whole command line to a running daemon, if one is configured
+    if args.socket and not args.daemon:
+        sys.exit(daemon_client(args.socket, sys.argv[1:]))
+    if args.daemon and not args.socket:
+        print("--daemon requires --socket (or PYBOARD_SOCKET)")
+        sys.exit(1)
 
     # open the connection to the pyboard
     try:
@@ -611,73 +3438,35 @@ def main():
     except PyboardError as er:
         print(er)
         sys.exit(1)
+    if args.record:
+        pyb.serial = RecordingSerial(pyb.serial, args.record)
 
-    # run any command or file(s)
-    if args.command is not None or args.filesystem or len(args.files):
-        # we must enter raw-REPL mode to execute commands
-        # this will do a soft-reset of the board
+    if args.daemon:
         try:
-            pyb.enter_raw_repl()
+            serve_daemon(pyb, args.socket, cmd_parser)
         except PyboardError as er:
             print(er)
             pyb.close()
             sys.exit(1)
-
-        def execbuffer(buf):
-            try:
-                if args.no_follow:
-                    pyb.exec_raw_no_follow(buf)
-                    ret_err = None
-                else:
-                    ret, ret_err = pyb.exec_raw(
-                        buf, timeout=None, data_consumer=stdout_write_bytes
-                    )
-            except PyboardError as er:
-                print(er)
-                pyb.close()
-                sys.exit(1)
-            except KeyboardInterrupt:
-                sys.exit(1)
-            if ret_err:
-                pyb.exit_raw_repl()
-                pyb.close()
-                stdout_write_bytes(ret_err)
-                sys.exit(1)
-
-        # do filesystem commands, if given
-        if args.filesystem:
-            filesystem_command(pyb, args.files)
-            del args.files[:]
-
-        # run the command, if given
-        if args.command is not None:
-            execbuffer(args.command.encode("utf-8"))
-
-        # run any files
-        for filename in args.files:
-            with open(filename, "rb") as f:
-                pyfile = f.read()
-                if filename.endswith(".mpy") and pyfile[0] == ord("M"):
-                    pyb.exec_("_injected_buf=" + repr(pyfile))
-                    pyfile = _injected_import_hook_code
-                execbuffer(pyfile)
-
-        # exiting raw-REPL just drops to friendly-REPL mode
-        pyb.exit_raw_repl()
-
-    # if asked explicitly, or no files given, then follow the output
-    if args.follow or (args.command is None and not args.filesystem and len(args.files) == 0):
+    elif args.watch:
+        # run anything given first, but don't fall back to following the output
+        if args.command is not None or args.filesystem or len(args.files):
+            run_commands(pyb, args)
         try:
-            ret, ret_err = pyb.follow(timeout=None, data_consumer=stdout_write_bytes)
+            watch_directory(pyb, args.watch, args.watch_dest, args.chunk_size, args.reload)
         except PyboardError as er:
             print(er)
-            sys.exit(1)
-        except KeyboardInterrupt:
-            sys.exit(1)
-        if ret_err:
             pyb.close()
-            stdout_write_bytes(ret_err)
             sys.exit(1)
+    else:
+        run_commands(pyb, args)
+
+    if args.stats:
+        stats = pyb.write_buffer.stats()
+        sys.stderr.write(
+            "serial writes: %u requested, %u made, %u bytes\n"
+            % (stats["logical_writes"], stats["physical_writes"], stats["bytes"])
+        )
 
     # close the connection to the pyboard
     pyb.close()
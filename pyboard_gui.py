@@ -1,31 +1,117 @@
-from typing import List, Dict, Set, Any
+import time
+_MODULE_LOAD_START = time.perf_counter()
+
+from typing import List, Dict, Set, Any, Callable, Optional
+import importlib
+import codecs
+import collections
 import logging
+import logging.handlers
+import queue
+import threading
 import tkinter as tk
-from tkinter.ttk import Progressbar
-import tkinter.filedialog as tkfd
-import tkinter.messagebox as tkmb
 import tkinter.scrolledtext as tkst
+import tkinter.ttk as ttk
 import pyboard as pyb
-import serial
-import serial.tools.list_ports
 import os
 import sys
 from io import StringIO
-import copy
+
+
+class StartupTimer:
+    """Collects import and construction costs for the startup timing mode."""
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.start = _MODULE_LOAD_START
+        self.entries = []
+        self.reported = False
+
+    def record(self, label: str, seconds: float):
+        if self.enabled and not self.reported:
+            self.entries.append((label, seconds))
+
+    def measure(self, label: str, func, *args):
+        start = time.perf_counter()
+        ret = func(*args)
+        self.record(label, time.perf_counter() - start)
+        return ret
+
+    def report(self):
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        lines = [f'{label}: {seconds * 1000:.1f} ms' for label, seconds in self.entries]
+        lines.append(f'total since module load: {(time.perf_counter() - self.start) * 1000:.1f} ms')
+        for line in lines:
+            logging.info('Startup timing: %s', line)
+            print('Startup timing:', line, file=sys.__stdout__)
+
+
+startup_timer = StartupTimer(enabled='--startup-timing' in sys.argv
+                             or bool(os.environ.get('PYBOARD_GUI_STARTUP_TIMING')))
+
+
+class LazyModule:
+    """Stands in for a module that is only imported on first attribute access."""
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = startup_timer.measure(f'import {self._name}',
+                                                 importlib.import_module, self._name)
+        return getattr(self._module, attr)
+
+
+tkfd = LazyModule('tkinter.filedialog')
+tkmb = LazyModule('tkinter.messagebox')
+list_ports = LazyModule('serial.tools.list_ports')
+startup_timer.record('module imports', time.perf_counter() - _MODULE_LOAD_START)
+
+# on-disk capture of all serial traffic, rotated once it reaches the size cap
+SERIAL_CAPTURE_PATH = os.environ.get('PYBOARD_GUI_SERIAL_LOG', 'pyboard_gui_serial.log')
+SERIAL_CAPTURE_MAX_BYTES = 10 * 1024 * 1024
+SERIAL_CAPTURE_BACKUPS = 5
 
 
 class StdoutRedirector(StringIO):
+    """File-like sink for a text widget that any thread may write to.
+
+    Writes are only buffered; render() inserts everything pending in one
+    go and must be called from the Tk thread.
+    """
     def __init__(self, text_widget: tk.Text):
         super().__init__()
         self.text_space = text_widget
+        self.pending = []
+        self.lock = threading.Lock()
+        # board output arrives as bytes that may split a UTF-8 sequence
+        self.decoder = codecs.getincrementaldecoder('utf8')('replace')
 
     def write(self, string: Any):
+        with self.lock:
+            if not isinstance(string, str):
+                string = self.decoder.decode(bytes(string))
+            self.pending.append(string)
+        return len(string)
+
+    def render(self):
+        with self.lock:
+            text = ''.join(self.pending)
+            self.pending = []
+        if not text:
+            return
         self.text_space.configure(state=tk.NORMAL)
-        self.text_space.insert(tk.END, string)
+        self.text_space.insert(tk.END, text)
         self.text_space.see(tk.END)
         self.text_space.configure(state=tk.DISABLED)
-        if type(string) != str and '\n' in string.decode('utf8'):
-            self.text_space.update_idletasks()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are, leaving formatting to the listener thread."""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
 
 class PyboardGUI(tk.Frame):
@@ -39,33 +125,57 @@ class PyboardGUI(tk.Frame):
         self.master.protocol("WM_DELETE_WINDOW", self.quit_clean)
         self.widgets = {}
         self.frames = {}
-        self.board_widgets = {}
-        self.console_widgets = {}
-        self.pyboard = None
+        # port -> open BoardSession, each shown in its own tab
+        self.sessions = {}
+        self.file_cache = pyb.FileCache()
         self.tk_vars = {}
         self.grid(sticky=tk.NSEW, column=0, row=0)
-        self.columnconfigure(2, weight=3)
+        self.columnconfigure(1, weight=3)
         self.rowconfigure(1, weight=3)
-        self.create_widgets()
-        self.create_board_widgets()
-        self.create_view_widgets()
-        self.create_console_widgets()
-        self.create_program_log_widgets()
-        self.disable_board_widgets()
-        self.disable_console_widgets()
-        self.update_serial_ports()
+        self._port_scan_results = queue.Queue()
+        startup_timer.measure('create_widgets', self.create_widgets)
+        startup_timer.measure('create_program_log_widgets', self.create_program_log_widgets)
         self.lift()
         self.safe_files = ['boot.py']
-        self.logging_redirector = StdoutRedirector(self.console_widgets['log'])
-        logging.basicConfig(format='%(asctime)s %(message)s',
-                            datefmt='%m/%d/%Y %I:%M:%S %p',
-                            level=logging.INFO,
-                            stream=self.logging_redirector)
+        # log calls only enqueue; a listener thread formats them into the
+        # buffered redirector and render_output() shows them in batches
+        self.logging_redirector = StdoutRedirector(self.widgets['log'])
+        self.log_queue = queue.Queue()
+        log_handler = logging.StreamHandler(self.logging_redirector)
+        log_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s',
+                                                   datefmt='%m/%d/%Y %I:%M:%S %p'))
+        self.log_listener = logging.handlers.QueueListener(self.log_queue, log_handler)
+        self.log_listener.start()
+        logging.basicConfig(level=logging.INFO,
+                            handlers=[DeferredQueueHandler(self.log_queue)])
         sys.stdout = self.logging_redirector
         sys.stderr = self.logging_redirector
-        self.serial_redirector = StdoutRedirector(self.console_widgets['text_serial'])
-        pyb.reset_stdout(self.serial_redirector)
+        # board output goes to each session's console; anything else printed
+        # by pyboard.py ends up in the program log
+        pyb.reset_stdout(self.logging_redirector)
+        # serial traffic logged by pyb.LoggingSerial, written out only while capturing
+        self.serial_capture = None
+        self.serial_capture_queue = queue.Queue()
+        serial_logger = logging.getLogger('pyboard.serial')
+        serial_logger.propagate = False
+        serial_logger.setLevel(logging.INFO)
+        serial_logger.addHandler(DeferredQueueHandler(self.serial_capture_queue))
+        self.render_output()
         logging.info('Pyboard.py GUI initialized!')
+        # the session panels and the first port scan wait until the window is up
+        self.after_idle(self.create_deferred_widgets)
+
+    def create_deferred_widgets(self):
+        startup_timer.record('window shown', time.perf_counter() - startup_timer.start)
+        startup_timer.measure('create_session_widgets', self.create_session_widgets)
+        threading.Thread(target=self.scan_serial_ports_forever, daemon=True).start()
+        self.poll_serial_ports()
+
+    def scan_serial_ports_forever(self, interval: float = 0.5):
+        while True:
+            self._port_scan_results.put(
+                startup_timer.measure('serial port scan', self.get_serial_ports))
+            time.sleep(interval)
 
     def create_widgets(self):
         self.frames['connect'] = tk.LabelFrame(
@@ -130,7 +240,7 @@ class PyboardGUI(tk.Frame):
             column=1,
             sticky=tk.W)
 
-        # Connect widget group
+        # Connect widget group; each connection opens a new session tab
         self.widgets['label_connect'] = tk.Label(
             self.frames['connect'],
             text='Connect status: \nUnconnected',
@@ -148,13 +258,122 @@ class PyboardGUI(tk.Frame):
             column=1,
             sticky=tk.W)
 
+        # Transfer chunk size widget group
+        self.widgets['label_chunk_size'] = tk.Label(
+            self.frames['connect'], text='Chunk size:')
+        self.widgets['label_chunk_size'].grid(
+            row=5,
+            column=0,
+            sticky=tk.E)
+        chunk_sizes = ['auto', '256', '1024', '4096']
+        self.tk_vars['chunk_size'] = tk.StringVar(self)
+        self.tk_vars['chunk_size'].set(chunk_sizes[0])
+        self.widgets['dropdown_chunk_size'] = tk.OptionMenu(
+            self.frames['connect'],
+            self.tk_vars['chunk_size'],
+            chunk_sizes[0],
+            *chunk_sizes[1:])
+        self.widgets['dropdown_chunk_size'].grid(
+            row=5,
+            column=1,
+            sticky=tk.W)
+
+        # Serial capture widget
+        self.tk_vars['capture_serial'] = tk.BooleanVar(self, value=False)
+        self.widgets['check_capture_serial'] = tk.Checkbutton(
+            self.frames['connect'],
+            text='Capture serial traffic to disk',
+            variable=self.tk_vars['capture_serial'],
+            command=self.toggle_serial_capture)
+        self.widgets['check_capture_serial'].grid(
+            row=6,
+            column=0,
+            columnspan=2,
+            sticky=tk.W)
+
+    def create_session_widgets(self):
+        self.frames['sessions'] = ttk.Notebook(self)
+        self.frames['sessions'].grid(
+            row=0, column=1, rowspan=2, sticky=tk.NSEW)
+
+        # Actions run in parallel on every session ticked for group actions
+        self.frames['group'] = tk.LabelFrame(
+            self,
+            text='Selected sessions',
+            padx=5,
+            pady=5
+        )
+        self.frames['group'].grid(
+            row=1, column=0, sticky=tk.NW)
+        self.tk_vars['group_command'] = tk.StringVar(self)
+        self.widgets['entry_group_command'] = tk.Entry(
+            self.frames['group'],
+            textvariable=self.tk_vars['group_command'])
+        self.widgets['entry_group_command'].grid(
+            row=0, column=0, sticky=tk.EW)
+        self.widgets['entry_group_command'].bind('<Return>', lambda x: self.run_on_selected())
+        self.widgets['btn_group_run'] = tk.Button(
+            self.frames['group'],
+            text='Run command on selected',
+            command=self.run_on_selected)
+        self.widgets['btn_group_run'].grid(
+            row=1, column=0, sticky=tk.W)
+        self.widgets['btn_group_upload'] = tk.Button(
+            self.frames['group'],
+            text='Upload file to selected',
+            command=self.upload_to_selected)
+        self.widgets['btn_group_upload'].grid(
+            row=2, column=0, sticky=tk.W)
+
+    def toggle_serial_capture(self):
+        serial_logger = logging.getLogger('pyboard.serial')
+        if self.tk_vars['capture_serial'].get():
+            try:
+                handler = logging.handlers.RotatingFileHandler(
+                    SERIAL_CAPTURE_PATH,
+                    maxBytes=SERIAL_CAPTURE_MAX_BYTES,
+                    backupCount=SERIAL_CAPTURE_BACKUPS)
+            except OSError as e:
+                logging.exception(e)
+                self.tk_vars['capture_serial'].set(False)
+                return
+            # every session logs on its own child logger, named after its port
+            handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+            self.serial_capture = logging.handlers.QueueListener(
+                self.serial_capture_queue, handler)
+            self.serial_capture.start()
+            serial_logger.setLevel(logging.DEBUG)
+            logging.info(f'Capturing serial traffic to {os.path.abspath(SERIAL_CAPTURE_PATH)}')
+        elif self.serial_capture is not None:
+            serial_logger.setLevel(logging.INFO)
+            self.serial_capture.stop()
+            for handler in self.serial_capture.handlers:
+                handler.close()
+            self.serial_capture = None
+            logging.info('Stopped capturing serial traffic')
+
+    def render_output(self, interval_ms: int = 50):
+        self.logging_redirector.render()
+        for session in self.sessions.values():
+            session.serial_redirector.render()
+        self.master.after(interval_ms, self.render_output)
+
     @staticmethod
     def get_optionmenu_options(optionmenu: tk.OptionMenu) -> Set[str]:
         return {optionmenu['menu'].entrycget(idx, 'label')
                 for idx in range(optionmenu['menu'].index(tk.END) + 1)}
 
+    def poll_serial_ports(self):
+        self.update_serial_ports()
+        self.master.after(500, self.poll_serial_ports)
+
     def update_serial_ports(self):
-        ports = self.get_serial_ports()
+        ports = None
+        while not self._port_scan_results.empty():
+            ports = self._port_scan_results.get_nowait()
+        if ports is None:
+            return
+        startup_timer.report()
         current_options = self.get_optionmenu_options(self.widgets['dropdown_port'])
         if current_options != ports:
             self.widgets['dropdown_port']['menu'].delete(0, tk.END)
@@ -163,9 +382,204 @@ class PyboardGUI(tk.Frame):
                     self.widgets['dropdown_port']['menu'].add_command(
                         label=p, command=lambda new_value=p: self.tk_vars['port'].set(new_value))
                 self.tk_vars['port'].set(self.widgets['dropdown_port']['menu'].entrycget(0, 'label'))
-            if self.pyboard is not None:
-                self.destroy_pyboard()
-        self.master.after(500, self.update_serial_ports)
+            # only the boards that went away lose their sessions
+            for port in current_options - ports:
+                if port in self.sessions:
+                    self.sessions[port].close()
+
+    def create_program_log_widgets(self):
+        self.frames['log'] = tk.LabelFrame(
+            self,
+            text='Program log',
+            padx=5,
+            pady=5
+        )
+        self.frames['log'].grid(
+            row=2, column=0, columnspan=2, sticky=tk.NSEW)
+        self.frames['log'].columnconfigure(0, weight=3)
+        self.frames['log'].rowconfigure(0, weight=3)
+
+        # Logging widget
+        self.widgets['log'] = tkst.ScrolledText(
+            self.frames['log'], state=tk.DISABLED, height=5, width=100)
+        self.widgets['log'].grid(
+            row=0, column=0, sticky=tk.NSEW)
+
+    def selected_sessions(self) -> List['BoardSession']:
+        return [session for session in self.sessions.values()
+                if session.tk_vars['selected'].get()]
+
+    def run_on_selected(self):
+        command = self.tk_vars['group_command'].get()
+        if not command:
+            return
+        sessions = self.selected_sessions()
+        if not sessions:
+            logging.warning('No sessions selected')
+            return
+        for session in sessions:
+            session.serial_redirector.write(f'>> {command}\n')
+            if not session.start_run(command):
+                logging.warning(f'{session.port} is busy, skipped')
+
+    def upload_to_selected(self):
+        sessions = self.selected_sessions()
+        if not sessions:
+            logging.warning('No sessions selected')
+            return
+        selected_file = tkfd.askopenfile(defaultextension='py')
+        if selected_file is None:
+            return
+        filename = os.path.basename(selected_file.name)
+        if filename in self.safe_files:
+            tkmb.showerror(title='Error!',
+                           message='Cannot overwrite protected file!')
+            return
+        for session in sessions:
+            if not session.start_upload(selected_file.name, filename):
+                logging.warning(f'{session.port} is busy, skipped')
+
+    def update_connect_text_and_buttons(self):
+        if self.sessions:
+            self.widgets['label_connect']['text'] = f'Connect status: \n{len(self.sessions)} connected'
+            self.widgets['label_connect']['fg'] = 'green'
+        else:
+            self.widgets['label_connect']['text'] = 'Connect status: \nUnconnected'
+            self.widgets['label_connect']['fg'] = 'red'
+        return
+
+    def connect_to_board(self):
+        port = self.tk_vars['port'].get()
+        if port in self.sessions:
+            # a port can only be opened once, so show its session instead
+            self.frames['sessions'].select(self.sessions[port])
+            return
+        # the port is opened on the session's worker; the tab goes if that fails
+        session = BoardSession(self, port)
+        self.sessions[port] = session
+        self.frames['sessions'].add(session, text=port)
+        self.frames['sessions'].select(session)
+        self.update_connect_text_and_buttons()
+        session.start(self.tk_vars['baudrate'].get())
+        return
+
+    def remove_session(self, session: 'BoardSession'):
+        del self.sessions[session.port]
+        self.frames['sessions'].forget(session)
+        self.update_connect_text_and_buttons()
+        logging.info(f'MicroPython board on {session.port} disconnected!')
+
+    def create_pyboard(self, port: str, baudrate) -> pyb.Pyboard:
+        """Open port; called on a session's worker thread."""
+        pyboard = pyb.Pyboard(port, baudrate)
+        # share one cache across connections; entries are keyed by board ID
+        pyboard.file_cache = self.file_cache
+        # traffic is only logged while the serial capture is on
+        serial_logger = logging.getLogger('pyboard.serial').getChild(port.replace('.', '_'))
+        pyboard.serial = pyb.LoggingSerial(pyboard.serial, serial_logger)
+        return pyboard
+
+    def quit_clean(self):
+        for session in list(self.sessions.values()):
+            session.close()
+        self.tk_vars['capture_serial'].set(False)
+        self.toggle_serial_capture()
+        self.log_listener.stop()
+        self.master.destroy()
+
+    @staticmethod
+    def get_serial_ports() -> Set[str]:
+        ports = [p.device for p in list_ports.comports()]
+        if len(ports) < 1:
+            return {'', }
+        else:
+            return set(ports)
+
+
+class BoardSession(tk.Frame):
+    """One connected board, shown in its own tab of the main window.
+
+    Each session has its own Pyboard, worker thread, console, file browser
+    and monitor; connection settings, the file cache and the log are
+    shared through app.
+    """
+    def __init__(self, app: PyboardGUI, port: str):
+        super().__init__(app.frames['sessions'])
+        self.app = app
+        self.port = port
+        # set once start() has opened the port
+        self.pyboard = None
+        self.closed = False
+        self.widgets = {}
+        self.frames = {}
+        self.board_widgets = {}
+        self.console_widgets = {}
+        self.monitor_widgets = {}
+        # directory path on the board ('' for the root) -> {name: size} as last listed;
+        # only directories that have been expanded in the file tree are listed
+        self.board_listing = {}
+        self.tree_sort = ('name', False)
+        # every exchange with the board runs on the worker thread, one job at a time;
+        # output and results come back to the Tk thread through run_output
+        self.jobs = queue.Queue()
+        self.run_output = queue.Queue()
+        self.pending_jobs = 0
+        self.locking_jobs = 0
+        self.drain_scheduled = False
+        self.running = False
+        self.watcher = None
+        self.metrics_history = collections.deque(maxlen=120)
+        self.tk_vars = {}
+        self.columnconfigure(1, weight=3)
+        self.rowconfigure(1, weight=3)
+        self.create_board_widgets()
+        self.create_view_widgets()
+        self.create_monitor_widgets()
+        self.create_console_widgets()
+        self.serial_redirector = StdoutRedirector(self.console_widgets['text_serial'])
+        self.disable_board_widgets()
+        self.disable_console_widgets()
+        threading.Thread(target=self.job_worker, daemon=True).start()
+        self.poll_device_metrics()
+
+    def start(self, baudrate):
+        """Open the port on the worker thread, then list the board's files."""
+        def job():
+            pyboard = self.app.create_pyboard(self.port, baudrate)
+            if self.closed:
+                pyboard.close()  # the tab was closed while connecting
+            return pyboard
+
+        def connected(pyboard: pyb.Pyboard):
+            self.pyboard = pyboard
+            logging.info(f'MicroPython board connected on {self.port}!')
+            if self.app.tk_vars['chunk_size'].get() == 'auto':
+                self.measure_link()
+            self.update_files_board_tree()
+
+        def failed(e: Exception):
+            logging.error(f'{self.port}: unable to connect: {e!r}')
+            tkmb.showerror('Creation failed!', 'Double-check that the baudrate is correct.')
+            self.close()
+
+        self.submit(job, connected, failed)
+
+    def close(self):
+        """Disconnect the board and remove its tab."""
+        if self.closed:
+            return
+        self.closed = True
+        # a running job fails on the closed connection and is then ignored
+        self.watcher = None
+        self.jobs.put(None)
+        if self.pyboard is not None:
+            try:
+                self.pyboard.close()
+            except Exception as e:
+                logging.exception(e)
+            self.pyboard = None
+        self.app.remove_session(self)
+        self.destroy()
 
     def create_board_widgets(self):
         self.frames['management'] = tk.LabelFrame(
@@ -175,32 +589,59 @@ class PyboardGUI(tk.Frame):
             pady=5
         )
         self.frames['management'].grid(
-            row=0, column=1, sticky=tk.NW)
+            row=0, column=0, sticky=tk.NW)
 
-        # Files listbox widget group
+        # Files tree widget group
         self.frames['files_board'] = tk.LabelFrame(
             self.frames['management'], text='Files on board:')
         self.frames['files_board'].grid(
             row=0,
             column=0,
             sticky=tk.W)
-        self.board_widgets['listbox_files'] = tk.Listbox(
-            self.frames['files_board'], selectmode=tk.SINGLE,
-            height=5)
-        self.board_widgets['listbox_files'].grid(
+        self.tk_vars['file_filter'] = tk.StringVar(self)
+        self.tk_vars['file_filter'].trace_add('write', lambda *args: self.arrange_files_board_tree())
+        self.board_widgets['entry_file_filter'] = tk.Entry(
+            self.frames['files_board'],
+            textvariable=self.tk_vars['file_filter'])
+        self.board_widgets['entry_file_filter'].grid(
             row=0,
             column=0,
+            columnspan=2,
+            sticky=tk.EW)
+        self.board_widgets['tree_files'] = ttk.Treeview(
+            self.frames['files_board'], columns=('size',), selectmode='browse',
+            height=8)
+        self.board_widgets['tree_files'].heading(
+            '#0', text='Name', command=lambda: self.sort_files_board_tree('name'))
+        self.board_widgets['tree_files'].heading(
+            'size', text='Size', command=lambda: self.sort_files_board_tree('size'))
+        self.board_widgets['tree_files'].column('#0', width=160)
+        self.board_widgets['tree_files'].column('size', width=70, anchor=tk.E)
+        self.board_widgets['tree_files'].bind(
+            '<<TreeviewOpen>>', lambda x: self.load_files_board_dir(
+                self.board_widgets['tree_files'].focus()))
+        self.board_widgets['tree_files'].grid(
+            row=1,
+            column=0,
             sticky=tk.W)
+        self.board_widgets['scroll_files'] = tk.Scrollbar(
+            self.frames['files_board'],
+            command=self.board_widgets['tree_files'].yview)
+        self.board_widgets['tree_files']['yscrollcommand'] = self.board_widgets['scroll_files'].set
+        self.board_widgets['scroll_files'].grid(
+            row=1,
+            column=1,
+            sticky=tk.NS)
         self.board_widgets['btn_refresh_files'] = tk.Button(
             self.frames['management'],
             text='Refresh files',
-            command=self.update_files_board_listbox)
+            command=self.update_files_board_tree)
         self.board_widgets['btn_refresh_files'].grid(
             row=1, column=0, sticky=tk.W)
         self.board_widgets['btn_view_file'] = tk.Button(
             self.frames['management'],
             text='View selected file',
-            command=self.view_file_board_listbox)
+            command=self.view_file_board_tree)
         self.board_widgets['btn_view_file'].grid(
             row=2, column=0, sticky=tk.W)
         self.board_widgets['btn_upload_file'] = tk.Button(
@@ -209,12 +650,61 @@ class PyboardGUI(tk.Frame):
             command=self.upload_file_board)
         self.board_widgets['btn_upload_file'].grid(
             row=3, column=0, sticky=tk.W)
+        self.board_widgets['btn_upload_folder'] = tk.Button(
+            self.frames['management'],
+            text='Upload folder to board',
+            command=self.upload_folder_board)
+        self.board_widgets['btn_upload_folder'].grid(
+            row=4, column=0, sticky=tk.W)
         self.board_widgets['btn_delete_file'] = tk.Button(
             self.frames['management'],
             text='Delete selected file',
             command=self.delete_file_board)
         self.board_widgets['btn_delete_file'].grid(
-            row=4, column=0, sticky=tk.W, pady=4)
+            row=5, column=0, sticky=tk.W, pady=4)
+        self.board_widgets['btn_verify_file'] = tk.Button(
+            self.frames['management'],
+            text='Verify selected file',
+            command=self.verify_file_board)
+        self.board_widgets['btn_verify_file'].grid(
+            row=6, column=0, sticky=tk.W)
+        self.tk_vars['verify'] = tk.BooleanVar(self, value=False)
+        self.board_widgets['check_verify'] = tk.Checkbutton(
+            self.frames['management'],
+            text='Verify uploads',
+            variable=self.tk_vars['verify'])
+        self.board_widgets['check_verify'].grid(
+            row=7, column=0, sticky=tk.W)
+        self.tk_vars['watch'] = tk.BooleanVar(self, value=False)
+        self.board_widgets['check_watch'] = tk.Checkbutton(
+            self.frames['management'],
+            text='Watch folder and push changes',
+            variable=self.tk_vars['watch'],
+            command=self.toggle_watch)
+        self.board_widgets['check_watch'].grid(
+            row=8, column=0, sticky=tk.W)
+        self.tk_vars['watch_reload'] = tk.BooleanVar(self, value=False)
+        self.board_widgets['check_watch_reload'] = tk.Checkbutton(
+            self.frames['management'],
+            text='Re-import changed modules',
+            variable=self.tk_vars['watch_reload'])
+        self.board_widgets['check_watch_reload'].grid(
+            row=9, column=0, sticky=tk.W)
+
+        # Session widgets stay usable while a command runs
+        self.tk_vars['selected'] = tk.BooleanVar(self, value=True)
+        self.widgets['check_selected'] = tk.Checkbutton(
+            self.frames['management'],
+            text='Include in group actions',
+            variable=self.tk_vars['selected'])
+        self.widgets['check_selected'].grid(
+            row=10, column=0, sticky=tk.W)
+        self.widgets['btn_close'] = tk.Button(
+            self.frames['management'],
+            text='Disconnect',
+            command=self.close)
+        self.widgets['btn_close'].grid(
+            row=11, column=0, sticky=tk.W, pady=4)
 
     def create_view_widgets(self):
         self.frames['file_view'] = tk.LabelFrame(
@@ -224,14 +714,121 @@ class PyboardGUI(tk.Frame):
             pady=5
         )
         self.frames['file_view'].grid(
-            row=0, column=2, sticky=tk.W+tk.E+tk.S+tk.N)
+            row=0, column=1, sticky=tk.W+tk.E+tk.S+tk.N)
         self.frames['file_view'].columnconfigure(0, weight=3)
 
         # File view widget
         self.board_widgets['text_view_file'] = tkst.ScrolledText(
             self.frames['file_view'], state=tk.DISABLED, height=12, width=50, wrap="none")
         self.board_widgets['text_view_file'].grid(
-            row=0, column=0, sticky=tk.NSEW)
+            row=0, column=0, columnspan=3, sticky=tk.NSEW)
+
+        # Search widgets: matching lines of the selected file or folder
+        # (or the whole board) are shown in the file view
+        self.tk_vars['grep_pattern'] = tk.StringVar(self)
+        self.board_widgets['entry_grep'] = tk.Entry(
+            self.frames['file_view'],
+            textvariable=self.tk_vars['grep_pattern'])
+        self.board_widgets['entry_grep'].grid(
+            row=1, column=0, sticky=tk.EW)
+        self.board_widgets['entry_grep'].bind('<Return>', lambda x: self.search_files_board())
+        self.tk_vars['grep_regex'] = tk.BooleanVar(self, value=False)
+        self.board_widgets['check_grep_regex'] = tk.Checkbutton(
+            self.frames['file_view'],
+            text='Regex',
+            variable=self.tk_vars['grep_regex'])
+        self.board_widgets['check_grep_regex'].grid(
+            row=1, column=1, sticky=tk.W)
+        self.board_widgets['btn_grep'] = tk.Button(
+            self.frames['file_view'],
+            text='Search',
+            command=self.search_files_board)
+        self.board_widgets['btn_grep'].grid(
+            row=1, column=2, sticky=tk.E)
+
+    def create_monitor_widgets(self):
+        self.frames['monitor'] = tk.LabelFrame(
+            self,
+            text='Device monitor',
+            padx=5,
+            pady=5
+        )
+        self.frames['monitor'].grid(
+            row=0, column=2, sticky=tk.NSEW)
+
+        # Memory history plot: green is free heap, red is allocated heap
+        self.monitor_widgets['canvas_plot'] = tk.Canvas(
+            self.frames['monitor'], width=240, height=100, bg='black')
+        self.monitor_widgets['canvas_plot'].grid(
+            row=0, column=0, columnspan=2, sticky=tk.NSEW)
+        self.monitor_widgets['label_metrics'] = tk.Label(
+            self.frames['monitor'], text='No samples yet', justify=tk.LEFT)
+        self.monitor_widgets['label_metrics'].grid(
+            row=1, column=0, columnspan=2, sticky=tk.W)
+
+        self.tk_vars['monitor_auto'] = tk.BooleanVar(self, value=False)
+        self.board_widgets['check_monitor_auto'] = tk.Checkbutton(
+            self.frames['monitor'],
+            text='Sample every 2 s',
+            variable=self.tk_vars['monitor_auto'])
+        self.board_widgets['check_monitor_auto'].grid(
+            row=2, column=0, sticky=tk.W)
+        self.board_widgets['btn_monitor_sample'] = tk.Button(
+            self.frames['monitor'],
+            text='Sample now',
+            command=self.sample_device_metrics_now)
+        self.board_widgets['btn_monitor_sample'].grid(
+            row=2, column=1, sticky=tk.E)
+
+    def poll_device_metrics(self):
+        if self.closed:
+            return
+        # sampling enters the raw REPL, which would interrupt a running program;
+        # programs started with start_run() report their own samples instead
+        if (self.pyboard is not None and not self.pending_jobs
+                and self.tk_vars['monitor_auto'].get()):
+            self.sample_device_metrics_now(lock=False)
+        self.after(2000, self.poll_device_metrics)
+
+    def sample_device_metrics_now(self, lock: bool = True):
+        def job():
+            self.pyboard.enter_raw_repl(soft_reset=False)
+            metrics = self.pyboard.sample_metrics()
+            self.pyboard.exit_raw_repl()
+            return metrics
+
+        def failed(e: Exception):
+            logging.error(f'{self.port}: error sampling metrics: {e!r}')
+            self.tk_vars['monitor_auto'].set(False)
+
+        self.submit(job, self.add_device_metrics, failed, lock=lock)
+
+    def add_device_metrics(self, metrics: Dict[str, Optional[int]]):
+        """Append one sample to the metrics ring buffer."""
+        self.metrics_history.append(metrics)
+        self.update_monitor_widgets()
+
+    def update_monitor_widgets(self):
+        latest = self.metrics_history[-1]
+        lines = [f"Free: {latest['mem_free']} B   Alloc: {latest['mem_alloc']} B"]
+        if latest['max_free_block'] is not None:
+            lines.append(f"Largest free block: {latest['max_free_block']} B")
+        if latest['exec_ms'] is not None:
+            lines.append(f"Last command: {latest['exec_ms']} ms")
+        self.monitor_widgets['label_metrics']['text'] = '\n'.join(lines)
+
+        canvas = self.monitor_widgets['canvas_plot']
+        canvas.delete('all')
+        if len(self.metrics_history) < 2:
+            return
+        width, height = int(canvas['width']), int(canvas['height'])
+        heap = max(m['mem_free'] + m['mem_alloc'] for m in self.metrics_history)
+        step = width / (self.metrics_history.maxlen - 1)
+        for key, colour in (('mem_free', 'green'), ('mem_alloc', 'red')):
+            points = []
+            for i, metrics in enumerate(self.metrics_history):
+                points += [i * step, height - (height - 2) * metrics[key] / heap]
+            canvas.create_line(*points, fill=colour)
 
     def create_console_widgets(self):
         self.frames['console'] = tk.LabelFrame(
@@ -241,7 +838,7 @@ class PyboardGUI(tk.Frame):
             pady=5
         )
         self.frames['console'].grid(
-            row=1, column=0, columnspan=3, sticky=tk.NSEW)
+            row=1, column=0, columnspan=4, sticky=tk.NSEW)
         self.frames['console'].columnconfigure(1, weight=3)
         self.frames['console'].rowconfigure(0, weight=3)
 
@@ -277,35 +874,183 @@ class PyboardGUI(tk.Frame):
         self.console_widgets['btn_exec_file'].grid(
             row=2, column=0, sticky=tk.SW, padx=4)
 
+        # Long-running execution with no timeout, stoppable with ctrl-C
+        self.console_widgets['btn_stop'] = tk.Button(
+            self.frames['console'],
+            text='Stop',
+            fg='red',
+            command=self.stop_run)
+        self.console_widgets['btn_stop'].grid(
+            row=2, column=1, sticky=tk.SW, padx=4)
+        self.console_widgets['btn_run_command'] = tk.Button(
+            self.frames['console'],
+            text='Run (no timeout)',
+            command=self.run_console_command)
+        self.console_widgets['btn_run_command'].grid(
+            row=2, column=1, sticky=tk.SE, padx=4)
+
     def send_console_command(self):
-        typed_command = copy.deepcopy(self.console_widgets['entry_serial'].get('1.0', tk.END))
+        typed_command = self.console_widgets['entry_serial'].get('1.0', tk.END)
         self.console_widgets['entry_serial'].delete(1.0, tk.END)
         self.serial_redirector.write(f'>> {typed_command}\n')
+        self.serial_redirector.render()
         self.console_widgets['text_serial'].update_idletasks()
         self.exec_command(typed_command)
         return 'break'  # needed to prevent extra newline inside text widget
 
-    def create_program_log_widgets(self):
-        self.frames['log'] = tk.LabelFrame(
-            self,
-            text='Program log',
-            padx=5,
-            pady=5
-        )
-        self.frames['log'].grid(
-            row=2, column=0, columnspan=3, sticky=tk.NSEW)
-        self.frames['log'].columnconfigure(0, weight=3)
-        self.frames['log'].rowconfigure(0, weight=3)
+    def run_console_command(self):
+        typed_command = self.console_widgets['entry_serial'].get('1.0', tk.END)
+        self.console_widgets['entry_serial'].delete(1.0, tk.END)
+        self.serial_redirector.write(f'>> {typed_command}\n')
+        self.start_run(typed_command)
 
-        # Logging widget
-        self.console_widgets['log'] = tkst.ScrolledText(
-            self.frames['log'], state=tk.DISABLED, height=5, width=100)
-        self.console_widgets['log'].grid(
-            row=0, column=0, sticky=tk.NSEW)
+    def start_run(self, command, modules: Optional[List[str]] = None) -> bool:
+        """Run command on the worker thread, streaming output until it ends or is stopped.
+
+        If modules is given they are re-imported instead, without a soft reset.
+        While 'Sample every 2 s' is on, the program reports its memory use
+        as it runs. Returns False, doing nothing, if the session is busy.
+        """
+        if self.locking_jobs:
+            return False
+        monitor = self.tk_vars['monitor_auto'].get()
+
+        def job():
+            if modules:
+                self.pyboard.enter_raw_repl(soft_reset=False)
+                ret, ret_err = self.pyboard.reimport(modules, data_consumer=self.run_output.put)
+            else:
+                self.pyboard.enter_raw_repl()
+                # metric samples arrive as dicts among the output chunks
+                ret, ret_err = self.pyboard.exec_streaming(
+                    command, data_consumer=self.run_output.put,
+                    metrics_consumer=self.run_output.put if monitor else None)
+            self.pyboard.exit_raw_repl()
+            return ret_err
+
+        def finished(ret_err: bytes):
+            self.running = False
+            self.console_write_bytes(ret_err)
+
+        def failed(e: Exception):
+            self.running = False
+            logging.error(f'{self.port}: error running command: {e!r}')
+
+        self.submit(job, finished, failed)
+        self.running = True
+        self.console_widgets['btn_stop']['state'] = tk.NORMAL
+        return True
+
+    def start_upload(self, src: str, dest: str) -> bool:
+        """Upload src to dest on the worker thread; False if the session is busy."""
+        if self.locking_jobs:
+            return False
+        chunk_size = self.app.tk_vars['chunk_size'].get()
+        verify = self.tk_vars['verify'].get()
+
+        def job():
+            start = time.time()
+            self.pyboard.enter_raw_repl()
+            self.pyboard.fs_put(src=src, dest=dest, chunk_size=chunk_size, verify=verify)
+            self.pyboard.exit_raw_repl()
+            return time.time() - start
+
+        def finished(elapsed: float):
+            logging.info(f'{self.port}: uploaded {dest} in {elapsed:.2f} s')
+            self.update_files_board_tree()
+
+        def failed(e: Exception):
+            logging.error(f'{self.port}: error uploading {dest}: {e!r}')
+            self.update_files_board_tree()
+
+        self.submit(job, finished, failed)
+        return True
+
+    def submit(self, job: Callable[[], Any], on_done: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[Exception], None]] = None, lock: bool = True):
+        """Queue job to run on the session's worker thread.
+
+        on_done(result) or on_error(exception) is then called on the Tk thread;
+        without on_error the exception is logged. Unless lock is False the board
+        and console widgets stay disabled until the job has finished.
+        """
+        if self.closed:
+            return
+        if lock:
+            if not self.locking_jobs:
+                self.disable_board_widgets()
+                self.disable_console_widgets()
+            self.locking_jobs += 1
+        self.pending_jobs += 1
+        if not self.drain_scheduled:
+            self.drain_scheduled = True
+            self.after(50, self.drain_run_output)
+        self.jobs.put((job, on_done, on_error, lock))
+
+    def job_worker(self):
+        # runs off the Tk thread, so it only talks to the UI through run_output
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                return  # the session has been closed
+            job, on_done, on_error, lock = item
+            try:
+                self.run_output.put((lock, on_done, job()))
+            except Exception as e:
+                self.run_output.put((lock, on_error or self.log_job_error, e))
+
+    def log_job_error(self, e: Exception):
+        logging.error(f'{self.port}: error talking to the board: {e!r}')
+
+    def drain_run_output(self):
+        if self.closed:
+            return
+        self.drain_scheduled = False
+        chunks = []
+        while not self.run_output.empty():
+            item = self.run_output.get_nowait()
+            if isinstance(item, tuple):
+                self.flush_console_chunks(chunks)
+                self.finish_job(*item)
+            elif isinstance(item, dict):
+                self.add_device_metrics(item)
+            else:
+                chunks.append(item)
+        self.flush_console_chunks(chunks)
+        if self.pending_jobs and not self.drain_scheduled:
+            self.drain_scheduled = True
+            self.after(50, self.drain_run_output)
+
+    def flush_console_chunks(self, chunks: List[bytes]):
+        if chunks:
+            self.console_write_bytes(b''.join(chunks))
+            chunks.clear()
+
+    def finish_job(self, lock: bool, callback, result):
+        self.pending_jobs -= 1
+        if lock:
+            self.locking_jobs -= 1
+            if not self.locking_jobs:
+                self.enable_board_widgets()
+                self.enable_console_widgets()
+        if callback is not None:
+            callback(result)
+
+    def stop_run(self):
+        if self.running and self.pyboard is not None:
+            logging.info('Interrupting running command')
+            self.pyboard.interrupt()
+
+    @staticmethod
+    def set_widget_state(widget: tk.Widget, state: str):
+        if isinstance(widget, ttk.Treeview):
+            widget.state(['disabled'] if state == tk.DISABLED else ['!disabled'])
+        else:
+            widget['state'] = state
 
     def disable_board_widgets(self):
         for widget in self.board_widgets.values():
-            widget['state'] = tk.DISABLED
+            self.set_widget_state(widget, tk.DISABLED)
 
     def disable_console_widgets(self):
         for widget in self.console_widgets.values():
@@ -313,21 +1058,21 @@ class PyboardGUI(tk.Frame):
 
     def enable_board_widgets(self):
         for widget in self.board_widgets.values():
-            widget['state'] = tk.NORMAL
+            self.set_widget_state(widget, tk.NORMAL)
 
     def enable_console_widgets(self):
         for widget in self.console_widgets.values():
             widget['state'] = tk.NORMAL
         self.console_widgets['text_serial']['state'] = tk.DISABLED
-        self.console_widgets['log']['state'] = tk.DISABLED
+        self.console_widgets['btn_stop']['state'] = tk.DISABLED
 
     # def exec_selected_file_board(self):
     #     try:
-    #         filename = self.get_selected_file_board_listbox()
+    #         filename = self.get_selected_file_board_tree()
     #         self.pyboard.enter_raw_repl()
     #         self.pyboard.exec(src=filename)
     #         self.pyboard.exit_raw_repl()
-    #         self.update_files_board_listbox()
+    #         self.update_files_board_tree()
     #     except Exception as e:
     #         logging.exception(e)
     #         tkmb.showerror(title='Error!',
@@ -335,181 +1080,409 @@ class PyboardGUI(tk.Frame):
     #     return
 
     def exec_command(self, command: str):
-        try:
+        def job():
             self.pyboard.enter_raw_repl()
-            ret = self.pyboard.exec_(
-                command, data_consumer=pyb.stdout_write_bytes)
+            self.pyboard.exec_timed(command, data_consumer=self.run_output.put)
+            metrics = self.pyboard.sample_metrics()
             self.pyboard.exit_raw_repl()
-            return ret
-        except Exception as e:
-            logging.exception(e)
+            return metrics
+
+        def failed(e: Exception):
+            logging.error(f'{self.port}: error running command: {e!r}')
             tkmb.showerror(title='Error!',
                            message='Error running command!')
-        return
+
+        self.submit(job, self.add_device_metrics, failed)
+
+    def console_write_bytes(self, b: bytes):
+        self.serial_redirector.write(b.replace(b'\x04', b''))
 
     def exec_host_file_board(self):
+        selected_file = tkfd.askopenfile(defaultextension='py')
+        if selected_file is None:
+            return
         try:
-            selected_file = tkfd.askopenfile(defaultextension='py')
-            filename = selected_file.name
-            self.pyboard.enter_raw_repl()
-            self.pyboard.exec(src=filename)
-            self.pyboard.exit_raw_repl()
-            self.update_files_board_listbox()
+            with open(selected_file.name, 'rb') as f:
+                command = f.read()
         except Exception as e:
             logging.exception(e)
             tkmb.showerror(title='Error!',
-                           message='Error deleting file!')
-        return
+                           message='Error reading file!')
+            return
+        self.serial_redirector.write(f'>> run {selected_file.name}\n')
+        self.start_run(command)
 
     def upload_file_board(self, safemode=True):
         selected_file = tkfd.askopenfile(defaultextension='py')
+        if selected_file is None:
+            return
         filename = os.path.basename(selected_file.name)
         filepath = selected_file.name
-        if safemode and filename in self.safe_files:
+        if safemode and filename in self.app.safe_files:
             tkmb.showerror(title='Error!',
                            message='Cannot delete protected file!')
             return
-        try:
+        chunk_size = self.app.tk_vars['chunk_size'].get()
+        verify = self.tk_vars['verify'].get()
+
+        def job():
             self.pyboard.enter_raw_repl()
-            self.pyboard.fs_put(src=filepath, dest=filename)
+            self.pyboard.fs_put(src=filepath, dest=filename,
+                                chunk_size=chunk_size, verify=verify)
             self.pyboard.exit_raw_repl()
-            self.update_files_board_listbox()
-        except Exception as e:
-            logging.exception(e)
+
+        def failed(e: Exception):
+            if isinstance(e, pyb.PyboardChecksumError):
+                logging.error(e)
+                tkmb.showerror(title='Upload error!',
+                               message=f'Uploaded file does not match {filename}!')
+            else:
+                logging.error(f'{self.port}: error uploading {filename}: {e!r}')
+                tkmb.showerror(title='Upload error!',
+                               message='Error uploading file!')
+
+        self.submit(job, lambda _: self.update_files_board_tree(), failed)
+
+    def verify_file_board(self):
+        src = self.get_selected_file_board_tree()
+        if src is None:
+            return
+        selected_file = tkfd.askopenfile(title=f'Compare {src} with...')
+        if selected_file is None:
+            return
+
+        def job():
+            self.pyboard.enter_raw_repl()
+            try:
+                digest = self.pyboard.fs_verify(src=selected_file.name, dest=src)
+            except pyb.PyboardChecksumError:
+                self.pyboard.exit_raw_repl()
+                raise
+            self.pyboard.exit_raw_repl()
+            return digest
+
+        def verified(digest: str):
+            logging.info(f'{src} matches {selected_file.name} (sha256 {digest})')
+            tkmb.showinfo(title='Verified', message=f'{src} matches the host file.')
+
+        def failed(e: Exception):
+            if isinstance(e, pyb.PyboardChecksumError):
+                logging.error(e)
+                tkmb.showerror(title='Mismatch!',
+                               message=f'{src} differs from the host file!')
+            else:
+                logging.error(f'{self.port}: error verifying {src}: {e!r}')
+                tkmb.showerror(title='Error!',
+                               message='Error verifying file!')
+
+        self.submit(job, verified, failed)
+
+    def upload_folder_board(self):
+        folderpath = tkfd.askdirectory()
+        if not folderpath:
+            return
+        chunk_size = self.app.tk_vars['chunk_size'].get()
+
+        def job():
+            self.pyboard.enter_raw_repl()
+            self.pyboard.fs_put_bundle(src=folderpath, dest=os.path.basename(folderpath),
+                                       chunk_size=chunk_size)
+            self.pyboard.exit_raw_repl()
+
+        def failed(e: Exception):
+            logging.error(f'{self.port}: error uploading {folderpath}: {e!r}')
             tkmb.showerror(title='Upload error!',
-                           message='Error uploading file!')
-        return
+                           message='Error uploading folder!')
+
+        self.submit(job, lambda _: self.update_files_board_tree(), failed)
+
+    def toggle_watch(self):
+        if not self.tk_vars['watch'].get():
+            self.watcher = None
+            logging.info('Stopped watching folder')
+            return
+        folderpath = tkfd.askdirectory()
+        if not folderpath:
+            self.tk_vars['watch'].set(False)
+            return
+
+        def watching(watcher: pyb.DirectoryWatcher):
+            if not self.tk_vars['watch'].get():
+                return  # switched off while the first scan ran
+            self.watcher = watcher
+            logging.info(f'Watching {folderpath}, changes are pushed to the board root')
+            self.poll_watcher(watcher)
+
+        # the scans walk the whole tree, so they run on the worker too
+        self.submit(lambda: pyb.DirectoryWatcher(folderpath), watching, lock=False)
+
+    def poll_watcher(self, watcher: pyb.DirectoryWatcher, interval_ms: int = 250):
+        if watcher is not self.watcher:
+            return
+        # changes made while disconnected or busy are picked up on a later poll
+        if self.pyboard is not None and not self.pending_jobs:
+            self.submit(watcher.poll, lambda changed: self.push_watched_changes(watcher, changed),
+                        lock=False)
+        self.after(interval_ms, self.poll_watcher, watcher)
+
+    def push_watched_changes(self, watcher: pyb.DirectoryWatcher, changed: List[str]):
+        if changed and watcher is self.watcher:
+            self.push_watched_files(watcher.root, changed)
+
+    def push_watched_files(self, root: str, changed: List[str]):
+        chunk_size = self.app.tk_vars['chunk_size'].get()
+        directories = self.listed_board_dirs()
+
+        def job():
+            start = time.time()
+            # no soft reset, here or for the tree listing, or the re-import
+            # would run on a fresh board
+            self.pyboard.enter_raw_repl(soft_reset=False)
+            self.pyboard.fs_put_bundle(src=root, dest='', files=changed, chunk_size=chunk_size)
+            elapsed = time.time() - start
+            listings = self.list_board_dirs_raw_repl(directories)
+            self.pyboard.exit_raw_repl()
+            return elapsed, listings
+
+        def pushed(result):
+            elapsed, listings = result
+            logging.info(f"Pushed {', '.join(changed)} in {elapsed:.2f} s")
+            self.apply_files_board_listings(listings)
+            modules = pyb.module_names(changed)
+            if self.tk_vars['watch_reload'].get() and modules:
+                self.serial_redirector.write(f">> reimport {', '.join(modules)}\n")
+                self.start_run(None, modules)
+
+        self.submit(job, pushed)
 
     def delete_file_board(self, safemode=True):
-        try:
-            filename = self.get_selected_file_board_listbox()
-            if safemode and filename in self.safe_files:
-                tkmb.showerror(title='Error!',
-                               message='Cannot delete protected file!')
-                return
+        filename = self.get_selected_file_board_tree()
+        if filename is None:
+            return
+        if safemode and filename in self.app.safe_files:
+            tkmb.showerror(title='Error!',
+                           message='Cannot delete protected file!')
+            return
+
+        def job():
             self.pyboard.enter_raw_repl()
             self.pyboard.fs_rm(src=filename)
             self.pyboard.exit_raw_repl()
-            self.update_files_board_listbox()
-        except Exception as e:
-            logging.exception(e)
+
+        def failed(e: Exception):
+            logging.error(f'{self.port}: error deleting {filename}: {e!r}')
             tkmb.showerror(title='Error!',
                            message='Error deleting file!')
-        return
 
-    def get_selected_file_board_listbox(self):
-        src_index = self.board_widgets['listbox_files'].curselection()
-        src = self.board_widgets['listbox_files'].get(src_index).split(':')[0]
-        return src
+        self.submit(job, lambda _: self.update_files_board_tree(), failed)
+
+    def get_selected_file_board_tree(self) -> Optional[str]:
+        selection = self.board_widgets['tree_files'].selection()
+        if not selection:
+            tkmb.showerror(title='Error!',
+                           message='No file selected!')
+            return None
+        return selection[0]
+
+    def view_file_board_tree(self):
+        src = self.get_selected_file_board_tree()
+        if src is None:
+            return
+        chunk_size = self.app.tk_vars['chunk_size'].get()
+        self.submit(lambda: self.pyboard_view_file(src, chunk_size), self.show_board_text)
 
-    def view_file_board_listbox(self):
-        src = self.get_selected_file_board_listbox()
-        filetext = self.pyboard_view_file(src)
+    def show_board_text(self, text: str):
         self.board_widgets['text_view_file']['state'] = tk.NORMAL
         self.board_widgets['text_view_file'].delete(1.0, tk.END)
-        self.board_widgets['text_view_file'].insert(tk.END, filetext)
+        self.board_widgets['text_view_file'].insert(tk.END, text)
         self.board_widgets['text_view_file']['state'] = tk.DISABLED
-        return
+
+    def search_files_board(self):
+        pattern = self.tk_vars['grep_pattern'].get()
+        if not pattern:
+            return
+        paths = list(self.board_widgets['tree_files'].selection()) or ['']
+        regex = self.tk_vars['grep_regex'].get()
+
+        def job():
+            self.pyboard.enter_raw_repl()
+            matches = self.pyboard.fs_grep(pattern, paths, regex=regex)
+            self.pyboard.exit_raw_repl()
+            return matches
+
+        def found(matches):
+            logging.info(f'{len(matches)} matches for {pattern!r} in {paths[0] or "the board"}')
+            self.show_board_text(''.join(
+                f"{path}:{lineno}: {line.decode('utf8', 'replace').rstrip()}\n"
+                for path, lineno, line in matches))
+
+        def failed(e: Exception):
+            logging.error(f'{self.port}: error searching files: {e!r}')
+            tkmb.showerror(title='Error!',
+                           message='Error searching files!')
+
+        self.submit(job, found, failed)
 
     def pyboard_view_file(self, src='', chunk_size=256) -> str:
         try:
             self.pyboard.enter_raw_repl()
-            cmd = (
-                    "with open('%s') as f:\n while 1:\n"
-                    "  b=f.read(%u)\n  if not b:break\n  print(b,end='')" % (src, chunk_size)
-            )
-            filetext = self.pyboard.exec(cmd)
+            hits = self.app.file_cache.hits
+            filetext = self.pyboard.fs_read(src, chunk_size, use_cache=True)
             self.pyboard.exit_raw_repl()
-            return filetext.decode('utf8')
+            if self.app.file_cache.hits > hits:
+                logging.info(f'{src} unchanged, shown from cache')
+            return filetext.decode('utf8', 'replace')
         except Exception as e:
             logging.exception(e)
             return ''
 
-    def update_connect_text_and_buttons(self):
-        if self.pyboard is not None:
-            self.widgets['label_connect']['text'] = 'Connect status: \nConnected!'
-            self.widgets['label_connect']['fg'] = 'green'
-            self.widgets['btn_connect']['text'] = 'Disconnect'
-            self.widgets['btn_connect']['command'] = self.destroy_pyboard
-            logging.info('MicroPython board connected!')
-        else:
-            self.widgets['label_connect']['text'] = 'Connect status: \nUnconnected'
-            self.widgets['label_connect']['fg'] = 'red'
-            self.widgets['btn_connect']['text'] = 'Connect to Board'
-            self.widgets['btn_connect']['command'] = self.connect_to_board
-            logging.info('MicroPython board disconnected!')
-        return
+    def measure_link(self):
+        def job():
+            self.pyboard.enter_raw_repl()
+            stats = self.pyboard.measure_link()
+            self.pyboard.exit_raw_repl()
+            return stats, self.pyboard.chunk_sizer('auto').size
 
-    def connect_to_board(self):
-        conn_success = self.create_pyboard()
-        if not conn_success:
-            logging.error('Unable to connect!')
-        else:
-            self.update_connect_text_and_buttons()
-            self.enable_board_widgets()
-            self.enable_console_widgets()
-            self.update_files_board_listbox()
-        return
+        def measured(result):
+            stats, chunk_size = result
+            logging.info(f"Link: RTT {stats['rtt'] * 1000:.1f} ms, "
+                         f"{stats['rate_to_board'] / 1024:.1f} KiB/s to board, "
+                         f"{stats['rate_from_board'] / 1024:.1f} KiB/s from board, "
+                         f"{stats['mem_free']} bytes free, "
+                         f"initial chunk size {chunk_size}")
 
-    def destroy_pyboard(self):
-        if self.pyboard is None:
-            return
-        try:
-            self.pyboard.close()
-        except Exception as e:
-            logging.exception(e)
-        self.pyboard = None
-        self.update_connect_text_and_buttons()
-        self.disable_board_widgets()
-        self.disable_console_widgets()
-        self.update_serial_ports()
-        return
+        self.submit(job, measured)
 
-    def create_pyboard(self):
-        try:
-            self.pyboard = pyb.Pyboard(self.tk_vars['port'].get(),
-                                       self.tk_vars['baudrate'].get())
-            return True
-        except Exception as e:
-            logging.exception(e)
-            tkmb.showerror('Creation failed!', 'Double-check that the baudrate is correct.')
-            return False
+    def listed_board_dirs(self) -> List[str]:
+        return sorted(self.board_listing.keys() | {''})
 
-    def update_files_board_listbox(self):
-        self.board_widgets['listbox_files'].delete(0, tk.END)
-        [self.board_widgets['listbox_files'].insert(tk.END, f'{filename}: {size}')
-         for filename, size in self.pyboard_list_files().items()]
-        return
+    def list_board_dirs_raw_repl(self, directories: List[str]) -> Dict[str, Dict[str, int]]:
+        listings = {}
+        for directory in directories:
+            try:
+                listings[directory] = self.list_files_raw_repl(directory)
+            except pyb.PyboardError:
+                # the directory has gone; its parent's listing removes it
+                pass
+        return listings
 
-    def pyboard_list_files(self, src='') -> Dict[str, int]:
-        try:
+    def update_files_board_tree(self):
+        """Re-list the root and every expanded directory in one raw REPL session
+        and apply the differences to the tree."""
+        directories = self.listed_board_dirs()
+
+        def job():
             self.pyboard.enter_raw_repl()
-            cmd = (
-                    "import uos\nfor f in uos.ilistdir(%s):\n"
-                    " print('{:12} {}{}'.format(f[3]if len(f)>3 else 0,f[0],'/'if f[1]&0x4000 else ''))"
-                    % (("'%s'" % src) if src else "")
-            )
-            files = self.pyboard.exec(cmd)
-            files = files.decode('utf8').split('\r\n')[0:-1]
-            files = [x.strip() for x in files]
-            files = {x.split(' ')[1]: int(x.split(' ')[0]) for x in files}
+            listings = self.list_board_dirs_raw_repl(directories)
             self.pyboard.exit_raw_repl()
-            return files
-        except Exception as e:
-            logging.exception(e)
-            return {}
+            return listings
 
-    def quit_clean(self):
-        self.destroy_pyboard()
-        self.master.destroy()
+        self.submit(job, self.apply_files_board_listings)
+
+    def apply_files_board_listings(self, listings: Dict[str, Dict[str, int]]):
+        # parents first, so removed directories are dropped before their children
+        for directory in sorted(listings, key=lambda d: d.count('/') + bool(d)):
+            if directory in self.board_listing or not directory:
+                self.apply_files_board_listing(directory, listings[directory])
+
+    def load_files_board_dir(self, directory: str):
+        if (directory in self.board_listing
+                or not self.board_widgets['tree_files'].tag_has('dir', directory)):
+            return
+
+        def loaded(listing: Dict[str, int]):
+            # the directory may have been loaded or removed by a refresh meanwhile
+            if (directory not in self.board_listing
+                    and self.board_widgets['tree_files'].exists(directory)):
+                self.apply_files_board_listing(directory, listing)
+
+        self.submit(lambda: self.pyboard_list_files(directory), loaded)
 
     @staticmethod
-    def get_serial_ports() -> Set[str]:
-        ports = [p.device for p in serial.tools.list_ports.comports()]
-        if len(ports) < 1:
-            return {'', }
+    def join_board_path(directory: str, name: str) -> str:
+        name = name.rstrip('/')
+        return f'{directory}/{name}' if directory else name
+
+    def apply_files_board_listing(self, directory: str, listing: Dict[str, int]):
+        tree = self.board_widgets['tree_files']
+        old = self.board_listing.get(directory, {})
+        placeholder = directory + '\n'
+        if tree.exists(placeholder):
+            tree.delete(placeholder)
+        for name in old.keys() - listing.keys():
+            path = self.join_board_path(directory, name)
+            tree.delete(path)
+            for loaded in [d for d in self.board_listing if d == path or d.startswith(path + '/')]:
+                del self.board_listing[loaded]
+        for name, size in listing.items():
+            path = self.join_board_path(directory, name)
+            if name not in old:
+                is_dir = name.endswith('/')
+                tree.insert(directory, tk.END, iid=path, text=name,
+                            values=('' if is_dir else size,), tags=('dir',) if is_dir else ())
+                if is_dir:
+                    # expandable until opened, then replaced by the real listing
+                    tree.insert(path, tk.END, iid=path + '\n', text='...')
+            elif old[name] != size and not name.endswith('/'):
+                tree.set(path, 'size', size)
+        self.board_listing[directory] = listing
+        self.arrange_files_board_tree(directory)
+
+    def arrange_files_board_tree(self, directory: str = None):
+        """Sort and filter the rows of one directory (or all loaded ones) on the host,
+        moving only rows whose position changes."""
+        if directory is None:
+            for loaded in list(self.board_listing):
+                self.arrange_files_board_tree(loaded)
+            return
+        tree = self.board_widgets['tree_files']
+        pattern = self.tk_vars['file_filter'].get().lower()
+        column, reverse = self.tree_sort
+        listing = self.board_listing[directory]
+        names = [name for name in listing if name.endswith('/') or pattern in name.lower()]
+        if column == 'size':
+            names.sort(key=lambda name: (listing[name], name.lower()), reverse=reverse)
         else:
-            return set(ports)
+            names.sort(key=str.lower, reverse=reverse)
+        names.sort(key=lambda name: not name.endswith('/'))  # directories first
+        wanted = [self.join_board_path(directory, name) for name in names]
+        current = list(tree.get_children(directory))
+        if current == wanted:
+            return
+        for name in listing.keys() - set(names):
+            path = self.join_board_path(directory, name)
+            if path in current:
+                tree.detach(path)
+                current.remove(path)
+        for index, path in enumerate(wanted):
+            if index < len(current) and current[index] == path:
+                continue  # already in place
+            tree.move(path, directory, index)
+            if path in current:
+                current.remove(path)
+            current.insert(index, path)
+
+    def sort_files_board_tree(self, column: str):
+        column_now, reverse = self.tree_sort
+        self.tree_sort = (column, not reverse if column == column_now else False)
+        self.arrange_files_board_tree()
+
+    def pyboard_list_files(self, src='') -> Dict[str, int]:
+        self.pyboard.enter_raw_repl()
+        files = self.list_files_raw_repl(src)
+        self.pyboard.exit_raw_repl()
+        return files
+
+    def list_files_raw_repl(self, src='') -> Dict[str, int]:
+        cmd = (
+                "import uos\nfor f in uos.ilistdir(%s):\n"
+                " print('{:12} {}{}'.format(f[3]if len(f)>3 else 0,f[0],'/'if f[1]&0x4000 else ''))"
+                % (("'%s'" % src) if src else "")
+        )
+        files = self.pyboard.exec(cmd)
+        files = files.decode('utf8').split('\r\n')[0:-1]
+        files = [x.strip().split(' ', 1) for x in files]
+        return {name: int(size) for size, name in files}
 
 
 def run_main_window():
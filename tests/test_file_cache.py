@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyboard  # noqa: E402
+
+
+def test_invalidate_without_device_id_drops_path_for_every_device():
+    # a fresh connection has no device id until device_id() runs, yet its
+    # writes must still evict what an earlier connection cached
+    cache = pyboard.FileCache()
+    cache.put(("board1", "c.txt", (4, 0)), b"AAAA")
+    cache.put(("board2", "c.txt", (4, 0)), b"AAAA")
+    cache.put(("board1", "d.txt", (4, 0)), b"DDDD")
+    cache.invalidate(None, "c.txt")
+    assert cache.get(("board1", "c.txt", (4, 0))) is None
+    assert cache.get(("board2", "c.txt", (4, 0))) is None
+    assert cache.get(("board1", "d.txt", (4, 0))) == b"DDDD"
+    assert cache.size == 4
+
+
+def test_invalidate_with_device_id_keeps_other_devices():
+    cache = pyboard.FileCache()
+    cache.put(("board1", "c.txt", (4, 0)), b"AAAA")
+    cache.put(("board2", "c.txt", (4, 0)), b"BBBB")
+    cache.invalidate("board1", "c.txt")
+    assert cache.get(("board1", "c.txt", (4, 0))) is None
+    assert cache.get(("board2", "c.txt", (4, 0))) == b"BBBB"
@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyboard  # noqa: E402
+
+
+def split(chunks):
+    data, metrics = [], []
+    splitter = pyboard.MetricsSplitter(data.append, metrics.append)
+    for chunk in chunks:
+        splitter(chunk)
+    return b"".join(data), [m["mem_free"] for m in metrics]
+
+
+def test_samples_split_across_chunks():
+    assert split([b"ab\x1dM1 2", b" 3\r", b"\ncd\x1dM4 5 6\r\nef\x04"]) == (b"abcdef\x04", [1, 4])
+
+
+def test_stray_group_separator_is_output():
+    assert split([b"a\x1db\ncd"]) == (b"a\x1db\ncd", [])
+    assert split([b"\x1dM1 2 3 4\n"]) == (b"\x1dM1 2 3 4\n", [])
+    assert split([b"\x1d" + b"1" * 100 + b"\n"]) == (b"\x1d" + b"1" * 100 + b"\n", [])
+
+
+def test_sample_after_stray_group_separator():
+    assert split([b"\x1d", b"\x1dM7 8 9\n"]) == (b"\x1d", [7])
@@ -0,0 +1,91 @@
+import binascii
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyboard  # noqa: E402
+
+
+class HostBoard(pyboard.Pyboard):
+    "Runs the device code with CPython in a local directory instead of on a board."
+
+    def __init__(self, root):
+        self.root = root
+        self.device = "host"
+        self._device_id = "host"
+        self.file_cache = pyboard.FileCache()
+        self.link_stats = None
+
+    def exec_(self, command, data_consumer=None):
+        out = io.StringIO()
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            with contextlib.redirect_stdout(out):
+                exec(command, {})
+        finally:
+            os.chdir(cwd)
+        data = out.getvalue().encode("utf8")
+        if data_consumer:
+            data_consumer(data)
+        return data
+
+    def fs_put_entries(self, entries, dest, chunk_size=256):
+        base = os.path.join(self.root, dest)
+        for entry in entries:
+            path = os.path.join(base, entry[1])
+            if entry[0] == "D":
+                os.makedirs(path, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with entry[3]() as src, open(path, "wb") as f:
+                    f.write(src.read())
+
+
+def _ilistdir(d="."):
+    for name in os.listdir(d):
+        yield name, 0x4000 if os.path.isdir(os.path.join(d, name)) else 0x8000, 0
+
+
+@pytest.fixture
+def board(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "uos", types.SimpleNamespace(ilistdir=_ilistdir))
+    monkeypatch.setitem(sys.modules, "uhashlib", hashlib)
+    monkeypatch.setitem(sys.modules, "ubinascii", binascii)
+    root = tmp_path / "board"
+    (root / "proj" / "pkg").mkdir(parents=True)
+    (root / "proj" / "m0.py").write_bytes(b"import pkg\n")
+    (root / "proj" / "empty.txt").write_bytes(b"")
+    (root / "proj" / "pkg" / "a.py").write_bytes(b"x = 1\n" * 100)
+    (root / "main.py").write_bytes(b"import proj\n")
+    return HostBoard(str(root))
+
+
+def test_snapshot_of_subdirectory_round_trips(board, tmp_path):
+    archive = str(tmp_path / "proj.tar.gz")
+    manifest = board.fs_snapshot(archive, "proj", chunk_size=64)
+    assert manifest["dirs"] == ["pkg"]
+    assert sorted(manifest["files"]) == ["empty.txt", "m0.py", "pkg/a.py"]
+
+    # unchanged files are skipped
+    assert board.fs_restore(archive, "proj") == []
+
+    root = board.root
+    with open(os.path.join(root, "proj", "m0.py"), "wb") as f:
+        f.write(b"changed\n")
+    os.remove(os.path.join(root, "proj", "pkg", "a.py"))
+    assert board.fs_restore(archive, "proj", verify=True) == ["m0.py", "pkg/a.py"]
+    with open(os.path.join(root, "proj", "m0.py"), "rb") as f:
+        assert f.read() == b"import pkg\n"
+    assert not os.path.exists(os.path.join(root, "proj", "proj"))
+
+    assert board.fs_restore(archive, "copy") == ["empty.txt", "m0.py", "pkg/a.py"]
+    with open(os.path.join(root, "copy", "pkg", "a.py"), "rb") as f:
+        assert f.read() == b"x = 1\n" * 100